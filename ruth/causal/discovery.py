@@ -1,5 +1,9 @@
+import hashlib
 import numpy as np
 import scipy.signal
+from collections import OrderedDict
+from fractions import Fraction
+from functools import lru_cache
 from typing import Dict, Any, List, Optional
 
 # Try to import tigramite
@@ -12,6 +16,55 @@ except ImportError:
     TIGRAMITE_AVAILABLE = False
     print("Warning: tigramite not found. Causal discovery will fail or return mock data.")
 
+# Try to import numba (optional accelerator for large graphs)
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Below this many variables the NumPy path wins (no JIT dispatch overhead)
+NUMBA_MIN_FEATURES = 256
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, cache=True)
+    def _summary_graph_numba(p_matrix, tau_max, alpha):
+        n_features = p_matrix.shape[0]
+        graph = np.zeros((n_features, n_features), dtype=np.int8)
+        for j in prange(n_features): # Effect
+            for i in range(n_features): # Cause
+                for tau in range(1, tau_max + 1):
+                    if p_matrix[i, j, tau] < alpha:
+                        graph[i, j] = 1 # i causes j
+                        break
+        return graph
+
+# PCMCI results memoized per (data digest, shape, params); oldest entries evicted first
+DISCOVERY_CACHE_SIZE = 32
+_discovery_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+
+@lru_cache(maxsize=32)
+def _resample_window(up: int, down: int) -> np.ndarray:
+    """
+    Builds the polyphase anti-aliasing FIR used by resample_poly for a given ratio.
+    Designed once per (up, down) and reused across calls (resample_poly copies it).
+    Matches scipy's default design: Kaiser window (beta=5.0), 10 zero-crossings per side.
+    """
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    return scipy.signal.firwin(2 * half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0))
+
+@lru_cache(maxsize=32)
+def _gravity_sos(target_fs: float, cutoff: float = 0.5) -> np.ndarray:
+    """
+    Designs the 2nd-order Butterworth high-pass (gravity removal) as second-order sections.
+    Cached per sampling rate, since every capture at the same target_fs uses the same filter.
+    """
+    nyquist = 0.5 * target_fs
+    normal_cutoff = cutoff / nyquist
+    # Second-order sections are numerically stabler than (b, a)
+    return scipy.signal.butter(N=2, Wn=normal_cutoff, btype='high', analog=False, output='sos')
+
 def preprocess_sensors(imu_data: np.ndarray, original_fs: float, target_fs: float = 5.0) -> np.ndarray:
     """
     Preprocesses IMU sensor data.
@@ -32,28 +85,84 @@ def preprocess_sensors(imu_data: np.ndarray, original_fs: float, target_fs: floa
     duration = n_samples / original_fs
     target_samples = int(duration * target_fs)
     
-    resampled_data = scipy.signal.resample(imu_data, target_samples, axis=0)
+    # Polyphase FIR (upfirdn) instead of a full-record FFT: O(N * taps), no pow-2 padding blowup
+    ratio = Fraction(target_fs / original_fs).limit_denominator(1000)
+    up, down = ratio.numerator, ratio.denominator
     
-    # 2. Remove Gravity (High-pass filter)
-    cutoff = 0.5
-    nyquist = 0.5 * target_fs
-    normal_cutoff = cutoff / nyquist
+    if up == down:
+        resampled_data = np.array(imu_data, dtype=float)
+    else:
+        resampled_data = scipy.signal.resample_poly(
+            imu_data, up, down, axis=0, window=_resample_window(up, down)
+        )[:target_samples]
     
-    b, a = scipy.signal.butter(N=2, Wn=normal_cutoff, btype='high', analog=False)
+    # 2. Remove Gravity (High-pass filter)
+    sos = _gravity_sos(float(target_fs))
     
     if n_channels >= 3:
-        for i in range(3):
-            resampled_data[:, i] = scipy.signal.filtfilt(b, a, resampled_data[:, i])
+        # Filter all accelerometer channels in one call (shared padding / setup)
+        # Default odd-extension padding is already tiny here (3 * (2 * n_sections + 1) = 9 samples)
+        resampled_data[:, :3] = scipy.signal.sosfiltfilt(sos, resampled_data[:, :3], axis=0)
             
     return resampled_data
 
-def run_discovery(time_series: np.ndarray, var_names: Optional[List[str]] = None) -> Dict[str, Any]:
+def _summary_graph(p_matrix: np.ndarray, tau_max: int, alpha: float) -> np.ndarray:
+    """
+    Collapses the lagged PCMCI p-values into a summary adjacency matrix.
+    A[i, j] = 1 if i(t-tau) -> j(t) is significant for any lag 1 <= tau <= tau_max.
+    
+    Args:
+        p_matrix: Shape (n_features, n_features, tau_max+1), indexed [cause, effect, lag].
+        tau_max: Maximum lag to consider.
+        alpha: Significance level.
+        
+    Returns:
+        Integer adjacency matrix of shape (n_features, n_features).
+    """
+    # Lag 0 (instantaneous) is ignored: causal discovery on time series focuses on lagged effects.
+    if NUMBA_AVAILABLE and p_matrix.shape[0] >= NUMBA_MIN_FEATURES:
+        # Parallel over effects, early exit on the first significant lag
+        return _summary_graph_numba(p_matrix, tau_max, alpha).astype(int)
+    
+    # One broadcast comparison + OR-reduce over the lag axis instead of an N*N*tau Python loop.
+    return (p_matrix[:, :, 1:tau_max + 1] < alpha).any(axis=2).astype(int)
+
+def _discovery_key(time_series: np.ndarray, var_names: List[str], tau_max: int, pc_alpha: float) -> tuple:
+    """
+    Cache key for run_discovery: a 128-bit BLAKE2b digest of the raw samples plus everything
+    else that changes the PCMCI output (shape, dtype, names, parameters).
+    """
+    data = np.ascontiguousarray(time_series)
+    digest = hashlib.blake2b(data.tobytes(), digest_size=16).digest()
+    return (digest, data.shape, data.dtype.str, tuple(var_names), int(tau_max), float(pc_alpha))
+
+def _copy_result(cached: Dict[str, Any]) -> Dict[str, Any]:
+    """Copies a cached result so callers can modify it without touching the cache."""
+    return {
+        "graph": cached["graph"].copy(),
+        "raw_results": {name: matrix.copy() for name, matrix in cached["raw_results"].items()},
+    }
+
+def clear_discovery_cache() -> None:
+    """Drops all memoized PCMCI results."""
+    _discovery_cache.clear()
+
+def run_discovery(
+    time_series: np.ndarray,
+    var_names: Optional[List[str]] = None,
+    tau_max: int = 3,
+    pc_alpha: float = 0.01,
+) -> Dict[str, Any]:
     """
     Runs causal discovery on the time series using Tigramite (PCMCI).
+    Results are memoized (LRU, DISCOVERY_CACHE_SIZE entries), so re-submitting the same
+    window across rounds skips PCMCI entirely.
     
     Args:
         time_series: Shape (n_samples, n_features)
         var_names: Optional list of variable names.
+        tau_max: Maximum lag.
+        pc_alpha: Significance level (also used to threshold the summary graph).
         
     Returns:
         Dictionary containing the causal graph (adjacency matrix) and encoded features.
@@ -71,6 +180,12 @@ def run_discovery(time_series: np.ndarray, var_names: Optional[List[str]] = None
     # 1. Create Tigramite DataFrame
     if var_names is None:
         var_names = [f"var_{i}" for i in range(n_features)]
+    
+    key = _discovery_key(time_series, var_names, tau_max, pc_alpha)
+    cached = _discovery_cache.get(key)
+    if cached is not None:
+        _discovery_cache.move_to_end(key)
+        return {**_copy_result(cached), "features": time_series}
         
     dataframe = pp.DataFrame(time_series, var_names=var_names)
     
@@ -80,8 +195,7 @@ def run_discovery(time_series: np.ndarray, var_names: Optional[List[str]] = None
     pcmci = PCMCI(dataframe=dataframe, cond_ind_test=parcorr, verbosity=0)
     
     # 3. Run PCMCI
-    # tau_max=3 (max lag), pc_alpha=0.01 (significance level)
-    results = pcmci.run_pcmci(tau_max=3, pc_alpha=0.01)
+    results = pcmci.run_pcmci(tau_max=tau_max, pc_alpha=pc_alpha)
     
     # 4. Extract Graph
     # p_matrix: (n_features, n_features, tau_max+1)
@@ -92,28 +206,23 @@ def run_discovery(time_series: np.ndarray, var_names: Optional[List[str]] = None
     # Note: PCMCI graph definition: graph[j, i, tau] means i(t-tau) -> j(t)
     
     p_matrix = results['p_matrix']
-    graph = np.zeros((n_features, n_features), dtype=int)
-    
-    tau_max = 3
-    alpha = 0.01
-    
-    for j in range(n_features): # Effect
-        for i in range(n_features): # Cause
-            # Check lags 1 to tau_max (we ignore lag 0 for instantaneous unless needed)
-            # Prompt doesn't specify, but usually causal discovery focuses on lagged effects for time series
-            for tau in range(1, tau_max + 1):
-                if p_matrix[i, j, tau] < alpha:
-                    graph[i, j] = 1 # i causes j
-                    break
-                    
-    return {
+    
+    graph = _summary_graph(p_matrix, tau_max, pc_alpha)
+    
+    _discovery_cache[key] = {
         "graph": graph,
-        "features": time_series, # In reality, might return learned features
         "raw_results": {
             "p_matrix": p_matrix,
             "val_matrix": results['val_matrix']
         }
     }
+    if len(_discovery_cache) > DISCOVERY_CACHE_SIZE:
+        _discovery_cache.popitem(last=False)
+    
+    return {
+        **_copy_result(_discovery_cache[key]),
+        "features": time_series, # In reality, might return learned features
+    }
 
 def validate_event(event: Dict[str, Any], graph: np.ndarray) -> bool:
     """
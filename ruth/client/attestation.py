@@ -16,11 +16,14 @@ def generate_binding_hash(payload: Dict[str, Any]) -> str:
     scalar = payload.get('scalar', '')
     model_hash = payload.get('model_hash', '')
     
-    # Construct binding string
-    binding_str = f"{seed_id}:{scalar}:{model_hash}"
-    
-    # Compute SHA256
-    return hashlib.sha256(binding_str.encode('utf-8')).hexdigest()
+    # Hash "{seed_id}:{scalar}:{model_hash}" field by field
+    # (no intermediate combined string is built)
+    h = hashlib.sha256(str(seed_id).encode('utf-8'))
+    h.update(b":")
+    h.update(str(scalar).encode('utf-8'))
+    h.update(b":")
+    h.update(str(model_hash).encode('utf-8'))
+    return h.hexdigest()
 
 def verify_attestation(token: str, binding_hash: str) -> bool:
     """
@@ -1,6 +1,6 @@
 import torch
 import numpy as np
-from typing import Dict, Any, Callable, Union
+from typing import Dict, Any, Callable, Optional, Union
 
 class ClientRuntime:
     """
@@ -12,39 +12,64 @@ class ClientRuntime:
         prng: Any, 
         epsilon_schedule: Union[float, Callable[[int], float]], 
         max_norm: float = 1.0,
-        model_path: str = None # Kept for API compatibility, ignored in prototype
+        model_path: str = None, # Kept for API compatibility, ignored in prototype
+        compile: bool = False,
+        cursor: Optional[int] = None
     ):
+        """
+        cursor: position in a PRNG shared with other clients (see Xoshiro256StarStar.advance_from).
+        The runtime then keeps its own seed position and never advances the shared PRNG.
+        None (default) draws from the PRNG's own position with next_seed(), i.e. an owned PRNG.
+        
+        compile=True wraps the antithetic forward pass with torch.compile (static shapes), so
+        the perturbed-weight add, LoRA matmuls, ReLU and loss are fused into one graph.
+        Worth it when batch shapes stay fixed (typical for federated rounds); a new batch shape
+        or epsilon value triggers a recompile. On ExecuTorch targets the AOT graph from
+        export_recipes plays this role instead.
+        """
         self.model = model
         self.prng = prng
         self.epsilon_schedule = epsilon_schedule
         self.max_norm = max_norm
+        self.cursor = cursor
         
         self.step_count = 0
         self.baseline = 0.0
         self.beta = 0.9 # Momentum for baseline moving average
+        
+        # Size of the noise vector, derived once from the model's trainable parameters.
+        # We assume the model has lora_a and lora_b as in RuthEdge.
+        self._num_params = sum(p.numel() for p in self.model.lora_a.parameters()) + \
+                           sum(p.numel() for p in self.model.lora_b.parameters())
+        
+        # Persistent noise buffer, refilled in place every step (v never outlives step())
+        self._noise_buf = torch.empty(self._num_params, dtype=torch.float32, device=getattr(self.prng, "device", None))
+        
+        self._perturb_pair = self.model.forward_perturb_pair
+        if compile:
+            self._perturb_pair = torch.compile(self._perturb_pair, dynamic=False, mode='reduce-overhead')
 
     def _get_epsilon(self) -> float:
         if callable(self.epsilon_schedule):
             return self.epsilon_schedule(self.step_count)
         return self.epsilon_schedule
 
-    def step(self, batch_x: torch.Tensor, batch_y: torch.Tensor) -> Dict[str, Any]:
+    def step(self, batch_x: torch.Tensor, batch_y: torch.Tensor, seed_index: Optional[int] = None) -> Dict[str, Any]:
         """
         Performs a single optimization step using Antithetic Sampling.
+        seed_index: explicit position in the seed schedule (e.g. assigned by the server for the
+        round); the PRNG position / cursor is then neither used nor advanced.
         Returns a dictionary with the seed_id, scalar update, and loss.
         """
         # 1. Get Seed and Noise
-        seed_id = self.prng.next_seed()
+        if seed_index is not None:
+            seed_id = self.prng.seed_at(seed_index)
+        elif self.cursor is None:
+            seed_id = self.prng.next_seed()
+        else:
+            seed_id, self.cursor = self.prng.advance_from(self.cursor)
         
-        # We need to know the shape of the noise vector.
-        # In a real scenario, this would be derived from the model's trainable parameters.
-        # For the RuthEdge prototype, we can calculate it dynamically or assume the model provides it.
-        # Let's calculate it from the model's trainable parameters (LoRA).
-        # We assume the model has lora_a and lora_b as in RuthEdge.
-        total_params = sum(p.numel() for p in self.model.lora_a.parameters()) + \
-                       sum(p.numel() for p in self.model.lora_b.parameters())
-        
-        v = self.prng.generate_noise_vector(seed_id, (total_params,))
+        v = self.prng.generate_noise_vector(seed_id, (self._num_params,), out=self._noise_buf)
         
         # 2. Inference (Loss 0)
         # We run this for logging/metrics, though strictly not needed for the gradient estimate itself
@@ -56,15 +81,15 @@ class ClientRuntime:
         epsilon = self._get_epsilon()
         
         with torch.no_grad():
-            # Perturb +epsilon
-            lossP = self.model.forward_perturb(batch_x, batch_y, v, epsilon)
-            
-            # Perturb -epsilon
-            lossM = self.model.forward_perturb(batch_x, batch_y, v, -epsilon)
+            # Perturb +epsilon / -epsilon (v is sliced once for both passes)
+            lossP, lossM = self._perturb_pair(batch_x, batch_y, v, epsilon)
             
         # 4. Gradient Estimate (Scalar rho)
         # rho = (L+ - L-) / (2 * epsilon)
-        rho = (lossP.item() - lossM.item()) / (2 * epsilon)
+        # Both values cross to the host in one transfer (one device sync instead of three).
+        # The rest is plain float math on a handful of scalars, cheaper than any tensor dispatch.
+        loss, loss_diff = torch.stack((loss0, lossP - lossM)).tolist()
+        rho = loss_diff / (2 * epsilon)
         
         # 5. Control Variate (Baseline subtraction)
         # Update running baseline of rho
@@ -82,7 +107,7 @@ class ClientRuntime:
         return {
             "seed_id": seed_id,
             "scalar": rho_adj,
-            "loss": loss0.item(),
+            "loss": loss,
             "raw_rho": rho,
             "epsilon": epsilon
         }
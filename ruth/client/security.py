@@ -1,8 +1,17 @@
 import os
 import base64
+import struct
 from cryptography.hazmat.primitives.asymmetric import ed25519
 from cryptography.hazmat.primitives import serialization
 
+# Signed payload: little-endian (seed_id: u64, scalar: f64, round_id: u64), 24 bytes.
+# Must match the server verifier (ruth.server.verifier).
+_PAYLOAD_FMT = struct.Struct("<QdQ")
+
+def _payload_bytes(seed_id: int, scalar: float, round_id: int) -> bytes:
+    """Canonical signed payload: one SHA-256 block, no string formatting."""
+    return _PAYLOAD_FMT.pack(seed_id, scalar, round_id)
+
 class SecurityManager:
     def __init__(self):
         # Load private key from secure storage (Env Var simulation)
@@ -21,20 +30,22 @@ class SecurityManager:
             self.private_key = ed25519.Ed25519PrivateKey.generate()
             
         self.public_key = self.private_key.public_key()
-
-    def get_public_key_bytes(self) -> bytes:
-        """Returns the public key in raw bytes format."""
-        return self.public_key.public_bytes(
+        # The key never changes for a session: serialize it once
+        self._public_key_bytes = self.public_key.public_bytes(
             encoding=serialization.Encoding.Raw,
             format=serialization.PublicFormat.Raw
         )
 
+    def get_public_key_bytes(self) -> bytes:
+        """Returns the public key in raw bytes format."""
+        return self._public_key_bytes
+
     def sign_update(self, seed_id: int, scalar: float, round_id: int) -> bytes:
         """
         Signs the update payload using Ed25519.
-        Payload structure: "{seed_id}:{scalar}:{round_id}"
+        Payload structure: struct "<QdQ" (seed_id, scalar, round_id)
         """
-        payload = f"{seed_id}:{scalar}:{round_id}".encode('utf-8')
+        payload = _payload_bytes(seed_id, scalar, round_id)
         return self.private_key.sign(payload)
 
     def get_attestation_token(self, seed_id: int, scalar: float, round_id: int) -> bytes:
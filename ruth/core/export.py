@@ -1,12 +1,14 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from typing import List, Tuple
 from torch.export import export
 try:
-    from torch.func import functional_call
+    from torch.func import functional_call, vmap
 except ImportError:
     print("Error: torch.func not available. Please upgrade PyTorch.")
     functional_call = None
+    vmap = None
 
 try:
     from executorch.exir import to_edge
@@ -31,6 +33,22 @@ class RuthEdge(nn.Module):
         self.head = nn.Linear(hidden_dim, output_dim)
         for param in self.head.parameters():
             param.requires_grad = False
+            
+        # Perturbation plan, built once instead of scanning named_parameters() every step
+        self._trainable = self._perturbation_plan()
+
+    def _perturbation_plan(self) -> List[Tuple[str, nn.Parameter, int, int]]:
+        """
+        (name, param, offset into v_flat, numel) for each trainable param (LoRA), in
+        named_parameters() order.
+        """
+        plan = []
+        offset = 0
+        for name, param in self.named_parameters():
+            if param.requires_grad:
+                plan.append((name, param, offset, param.numel()))
+                offset += param.numel()
+        return plan
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         """
@@ -60,31 +78,14 @@ class RuthEdge(nn.Module):
         Stateless forward pass with perturbed weights using torch.func.functional_call.
         W' = W + epsilon * v
         """
-        # 1. Construct the perturbed state dictionary
+        # 1. Construct the perturbed parameter overrides
         # We only perturb LoRA weights: lora_a.weight, lora_b.weight
-        # We need to reconstruct the shapes from v_flat
-        
-        # Get current state dict (names and params)
-        params = dict(self.named_parameters())
-        
-        # Identify trainable params (LoRA)
-        trainable_names = [n for n, p in self.named_parameters() if p.requires_grad]
-        
-        offset = 0
+        # functional_call takes a partial dict: frozen params are read from the module itself
         perturbed_params = {}
         
-        # Copy all params first (including frozen ones)
-        for name, param in params.items():
-            perturbed_params[name] = param
-
-        # Apply perturbation to trainable params
-        for name in trainable_names:
-            param = params[name]
-            numel = param.numel()
-            
-            # Extract v for this param
+        # Apply perturbation to trainable params at their fixed offsets in v_flat
+        for name, param, offset, numel in self._trainable:
             v_param = v_flat[offset : offset + numel].view_as(param)
-            offset += numel
             
             # W' = W + epsilon * v
             perturbed_params[name] = param + epsilon * v_param
@@ -98,6 +99,32 @@ class RuthEdge(nn.Module):
         loss = F.cross_entropy(logits, y)
         return loss
 
+    @torch.no_grad()
+    def forward_perturb_pair(self, x: torch.Tensor, y: torch.Tensor, v_flat: torch.Tensor, epsilon: float) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Antithetic pair of forward_perturb: returns (loss(W + epsilon * v), loss(W - epsilon * v)).
+        Both perturbed weight sets (from the _trainable plan) are stacked along a leading
+        "perturbation" dim and forward() is vmapped over it, so one pass with batched matmuls
+        yields both losses; v_flat is sliced once and the frozen (unbatched) base path is
+        computed once for both.
+        Runs without autograd: the antithetic estimate only needs the two loss values.
+        """
+        # +epsilon / -epsilon along the perturbation dim
+        signs = torch.tensor([epsilon, -epsilon], dtype=v_flat.dtype, device=v_flat.device)
+        
+        # Stacked W' = [W + epsilon * v, W - epsilon * v] per trainable param (LoRA)
+        stacked = {}
+        for name, param, offset, numel in self._trainable:
+            v_param = v_flat[offset : offset + numel].view_as(param)
+            stacked[name] = param + signs.view(-1, *([1] * param.dim())) * v_param
+            
+        # The module's own forward(), batched over the perturbation dim
+        def perturbed_loss(perturbed_params: dict) -> torch.Tensor:
+            return F.cross_entropy(functional_call(self, perturbed_params, (x,)), y)
+            
+        losses = vmap(perturbed_loss)(stacked)
+        return losses[0], losses[1]
+
 def export_recipes(output_dir: str = "."):
     if to_edge is None:
         print("Skipping export: executorch not available.")
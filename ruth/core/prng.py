@@ -1,33 +1,246 @@
 import numpy as np
 import torch
-from typing import List, Tuple
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
+# Try to import numba (required by the "xoshiro" backend)
+try:
+    from numba import get_num_threads, njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Single xoshiro streams at least this long are split into a serial state-advance pass and a
+# parallel Box-Muller pass (the transcendentals are ~95% of the cost; the state update is not)
+XOSHIRO_SPLIT_MIN = 1 << 16
+# Pairs of raw draws buffered per split block (1 MiB of uint64)
+_XOSHIRO_SPLIT_PAIRS = 1 << 16
+
+if NUMBA_AVAILABLE:
+    # Same xoshiro256** / SplitMix64 / Box-Muller pipeline as the on-device trainer
+    # (ruth/core/cpp/fwd_llm.cpp: RuthTrainer::generate_perturbation)
+    
+    @njit(cache=True)
+    def _rotl(x, k):
+        return (x << k) | (x >> (np.uint64(64) - k))
+        
+    @njit(cache=True)
+    def _xoshiro_next(s):
+        result = _rotl(s[1] * np.uint64(5), np.uint64(7)) * np.uint64(9)
+        t = s[1] << np.uint64(17)
+        s[2] ^= s[0]
+        s[3] ^= s[1]
+        s[1] ^= s[2]
+        s[0] ^= s[3]
+        s[2] ^= t
+        s[3] = _rotl(s[3], np.uint64(45))
+        return result
+        
+    @njit(cache=True)
+    def _xoshiro_states(seeds):
+        # One 256-bit state per seed, expanded with SplitMix64
+        states = np.empty((seeds.shape[0], 4), dtype=np.uint64)
+        for k in range(seeds.shape[0]):
+            x = seeds[k]
+            for i in range(4):
+                x += np.uint64(0x9E3779B97F4A7C15)
+                z = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+                z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+                states[k, i] = z ^ (z >> np.uint64(31))
+        return states
+        
+    @njit(cache=True)
+    def _box_muller(raw1, raw2):
+        # Two 53-bit uniforms -> two standard normals
+        scale = 1.1102230246251565e-16 # 2^-53
+        u1 = (raw1 >> np.uint64(11)) * scale
+        u2 = (raw2 >> np.uint64(11)) * scale
+        if u1 <= 0.0:
+            u1 = 1.0e-10
+        mag = np.sqrt(-2.0 * np.log(u1))
+        return mag * np.cos(2.0 * np.pi * u2), mag * np.sin(2.0 * np.pi * u2)
+        
+    @njit(cache=True)
+    def _xoshiro_normal_fill(s, out):
+        # Box-Muller on consecutive pairs of draws; an odd tail draws a full pair and keeps z0
+        n = out.shape[0]
+        for i in range(0, n, 2):
+            z0, z1 = _box_muller(_xoshiro_next(s), _xoshiro_next(s))
+            out[i] = z0
+            if i + 1 < n:
+                out[i + 1] = z1
+                
+    @njit(parallel=True, cache=True)
+    def _xoshiro_fill_split(s, out):
+        # Same stream as _xoshiro_normal_fill(s, out), for one long vector: the serial part only
+        # advances the state into a raw buffer, Box-Muller then runs across threads.
+        # Blocks hold an even count, so pairs never straddle a block boundary.
+        n = out.shape[0]
+        raw = np.empty(2 * _XOSHIRO_SPLIT_PAIRS, dtype=np.uint64)
+        for start in range(0, n, 2 * _XOSHIRO_SPLIT_PAIRS):
+            pairs = (min(2 * _XOSHIRO_SPLIT_PAIRS, n - start) + 1) // 2
+            for i in range(2 * pairs):
+                raw[i] = _xoshiro_next(s)
+            for p in prange(pairs):
+                z0, z1 = _box_muller(raw[2 * p], raw[2 * p + 1])
+                i = start + 2 * p
+                out[i] = z0
+                if i + 1 < n:
+                    out[i + 1] = z1
+                
+    @njit(parallel=True, cache=True)
+    def _xoshiro_fill_batch(states, out):
+        # Row k continues state k (states are advanced in place); rows run in parallel
+        for k in prange(states.shape[0]):
+            _xoshiro_normal_fill(states[k], out[k])
+            
+    def _xoshiro_fill(states, out):
+        # Parallel over rows, or within the row when there is only one long one
+        if states.shape[0] == 1 and out.shape[1] >= XOSHIRO_SPLIT_MIN and get_num_threads() > 1:
+            _xoshiro_fill_split(states[0], out[0])
+        else:
+            _xoshiro_fill_batch(states, out)
 
 class Xoshiro256StarStar:
     """
     Deterministic PRNG wrapper for FedKSeed.
     Uses numpy's PCG64 (default_rng) for robust, architecture-independent reproducibility.
+    
+    backend="torch" draws the noise with a seeded torch.Generator directly on `device` instead
+    (Philox on CUDA), skipping the numpy buffer and the host->torch copy. Its stream differs from
+    the numpy backend and is only reproducible across machines for the CPU generator, so clients
+    and server must agree on the backend.
+    
+    backend="xoshiro" (requires numba) runs the actual xoshiro256** stream of the C++ on-device
+    trainer as a compiled kernel, in parallel across seeds for noise matrices. Output is on the CPU.
+    
+    cache_size > 0 keeps the last cache_size (seed_id, shape) noise vectors (LRU), so a seed shared
+    by several clients in a round is generated once. Cached vectors are returned as-is (shared):
+    callers must not modify them in place. Matrices and `out=` fills are always fresh copies.
+    
+    Clients that follow the same seed schedule can share one instance: each keeps only an integer
+    cursor (see get_cursor / advance_from) instead of its own PRNG object.
     """
-    def __init__(self, seeds: List[int]):
+    def __init__(
+        self,
+        seeds: List[int],
+        backend: str = "numpy",
+        device: Optional[Union[str, torch.device]] = None,
+        cache_size: int = 0,
+    ):
+        if backend not in ("numpy", "torch", "xoshiro"):
+            raise ValueError(f"Unknown PRNG backend: {backend}")
+        if backend == "xoshiro" and not NUMBA_AVAILABLE:
+            raise ValueError("The xoshiro PRNG backend requires numba")
+            
         self.seeds = seeds
         self.current_epoch = 0
+        self.backend = backend
+        self.device = torch.device(device) if device is not None else torch.device("cpu")
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[int, Tuple[int, ...]], torch.Tensor]" = OrderedDict()
 
     def next_seed(self) -> int:
         """
         Returns the next seed index based on the current epoch.
         Cycles through the provided seeds list.
         """
+        seed, self.current_epoch = self.advance_from(self.current_epoch)
+        return seed
+
+    def get_cursor(self) -> int:
+        """Returns the position next_seed() would draw from (a starting cursor for advance_from)."""
+        return self.current_epoch
+
+    def advance_from(self, cursor: int) -> Tuple[int, int]:
+        """
+        next_seed() for a caller-held cursor: returns (seed, new_cursor).
+        Does not touch this PRNG's own position, so any number of cursors can share one instance.
+        """
+        return self.seed_at(cursor), cursor + 1
+
+    def seed_at(self, index: int) -> int:
+        """
+        Seed at position `index` of the cyclic schedule (what the index-th next_seed() returns).
+        Pure lookup: safe to call from any number of threads.
+        """
         if not self.seeds:
             raise ValueError("No seeds provided")
         
-        seed_idx = self.current_epoch % len(self.seeds)
-        self.current_epoch += 1
-        return self.seeds[seed_idx]
+        return self.seeds[index % len(self.seeds)]
+
+    def clear_round_cache(self) -> None:
+        """Drops all cached noise vectors (e.g. once a round has been aggregated)."""
+        self._cache.clear()
+
+    def _cached_vector(self, seed_id: int, shape: Tuple[int]) -> torch.Tensor:
+        key = (int(seed_id), tuple(shape))
+        noise = self._cache.get(key)
+        if noise is not None:
+            self._cache.move_to_end(key)
+            return noise
+            
+        noise = self._generate_noise_vector(seed_id, shape)
+        self._cache[key] = noise
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return noise
 
-    def generate_noise_vector(self, seed_id: int, shape: Tuple[int]) -> torch.Tensor:
+    def _torch_generator(self, seed_id: int) -> torch.Generator:
+        gen = torch.Generator(device=self.device)
+        gen.manual_seed(int(seed_id))
+        return gen
+
+    @staticmethod
+    def _xoshiro_states(seed_ids: Sequence[int]) -> np.ndarray:
+        return _xoshiro_states(np.asarray(seed_ids, dtype=np.uint64).reshape(-1))
+
+    def generate_noise_vector(self, seed_id: int, shape: Tuple[int], out: Optional[torch.Tensor] = None) -> torch.Tensor:
         """
         Generates a flattened noise vector drawn from a Standard Normal distribution.
         Reproducible across architectures given the same seed_id.
+        
+        If `out` is given (contiguous float32 with prod(shape) elements), the noise is written
+        into it in place and a flat view of it is returned: no allocation, no copy.
+        The contents are overwritten by the next call that reuses the same buffer.
         """
+        if out is not None:
+            numel = int(np.prod(shape))
+            if out.numel() != numel or out.dtype != torch.float32 or not out.is_contiguous():
+                raise ValueError(f"out must be a contiguous float32 tensor with {numel} elements")
+                
+        if self.cache_size:
+            noise = self._cached_vector(seed_id, shape)
+            if out is None:
+                return noise
+            return out.view(-1).copy_(noise)
+            
+        return self._generate_noise_vector(seed_id, shape, out)
+
+    def _generate_noise_vector(self, seed_id: int, shape: Tuple[int], out: Optional[torch.Tensor] = None) -> torch.Tensor:
+        if out is not None:
+            numel = int(np.prod(shape))
+            flat = out.view(-1)
+            
+            if self.backend == "torch":
+                torch.randn(numel, generator=self._torch_generator(seed_id), out=flat)
+            elif self.backend == "xoshiro":
+                _xoshiro_fill(self._xoshiro_states([seed_id]), flat.numpy().reshape(1, -1))
+            else:
+                # Numpy view shares the torch storage
+                rng = np.random.default_rng(seed=seed_id)
+                rng.standard_normal(dtype=np.float32, out=flat.numpy())
+            return flat
+            
+        if self.backend == "torch":
+            gen = self._torch_generator(seed_id)
+            return torch.randn(shape, generator=gen, dtype=torch.float32, device=self.device).flatten()
+            
+        if self.backend == "xoshiro":
+            noise = np.empty((1, int(np.prod(shape))), dtype=np.float32)
+            _xoshiro_fill(self._xoshiro_states([seed_id]), noise)
+            return torch.from_numpy(noise[0])
+            
         # Initialize numpy generator with the specific seed
         rng = np.random.default_rng(seed=seed_id)
         
@@ -37,3 +250,74 @@ class Xoshiro256StarStar:
         
         # Convert to torch tensor and flatten
         return torch.from_numpy(noise).flatten()
+
+    def generate_noise_matrix(self, seed_ids: Sequence[int], shape: Tuple[int]) -> torch.Tensor:
+        """
+        Generates one flattened noise vector per seed, stacked into a (num_seeds, prod(shape)) tensor.
+        Row k is identical to generate_noise_vector(seed_ids[k], shape).
+        """
+        numel = int(np.prod(shape))
+        
+        if self.cache_size and len(seed_ids):
+            # Repeated seeds are generated once; the stacked matrix is a fresh copy
+            return torch.stack([self._cached_vector(seed_id, shape) for seed_id in seed_ids])
+            
+        if self.backend == "torch":
+            noise = torch.empty((len(seed_ids), numel), dtype=torch.float32, device=self.device)
+            for k, seed_id in enumerate(seed_ids):
+                torch.randn(numel, generator=self._torch_generator(seed_id), out=noise[k])
+            return noise
+            
+        # Single preallocated buffer; each generator writes straight into its row (no per-seed alloc)
+        noise = np.empty((len(seed_ids), numel), dtype=np.float32)
+        
+        if self.backend == "xoshiro":
+            _xoshiro_fill(self._xoshiro_states(seed_ids), noise)
+            return torch.from_numpy(noise)
+            
+        for k, seed_id in enumerate(seed_ids):
+            rng = np.random.default_rng(seed=seed_id)
+            rng.standard_normal(dtype=np.float32, out=noise[k])
+            
+        return torch.from_numpy(noise)
+
+    def generate_noise_blocks(
+        self, seed_ids: Sequence[int], shape: Tuple[int], block_size: int
+    ) -> Iterator[Tuple[int, torch.Tensor]]:
+        """
+        Streams generate_noise_matrix(seed_ids, shape) column block by column block.
+        Yields (start, block) where block == matrix[:, start:start + block_size],
+        so the full (num_seeds, prod(shape)) matrix is never materialized.
+        
+        The yielded tensor is a reused buffer: it is only valid until the next iteration.
+        """
+        numel = int(np.prod(shape))
+        
+        if self.backend == "xoshiro" and block_size % 2 == 0:
+            # States carry over between blocks; even blocks keep the Box-Muller pairs aligned,
+            # so the concatenation is bit-identical to the full draw
+            states = self._xoshiro_states(seed_ids)
+            buf = np.empty((len(seed_ids), min(block_size, numel)), dtype=np.float32)
+            for start in range(0, numel, block_size):
+                block = buf[:, : min(block_size, numel - start)]
+                _xoshiro_fill(states, block)
+                yield start, torch.from_numpy(block)
+            return
+            
+        if self.backend in ("torch", "xoshiro"):
+            # torch.randn draws are not chunk-invariant (nor are odd xoshiro blocks): generate once and slice
+            noise = self.generate_noise_matrix(seed_ids, shape)
+            for start in range(0, numel, block_size):
+                yield start, noise[:, start : start + block_size]
+            return
+            
+        # One live generator per seed; consecutive draws continue each seed's stream,
+        # so concatenated blocks are bit-identical to a single full-length draw
+        rngs = [np.random.default_rng(seed=seed_id) for seed_id in seed_ids]
+        buf = np.empty((len(seed_ids), min(block_size, numel)), dtype=np.float32)
+        
+        for start in range(0, numel, block_size):
+            block = buf[:, : min(block_size, numel - start)]
+            for k, rng in enumerate(rngs):
+                rng.standard_normal(dtype=np.float32, out=block[k])
+            yield start, torch.from_numpy(block)
@@ -1,39 +1,73 @@
+import numpy as np
 import torch
-from typing import List, Dict, Tuple, Any
+from typing import List, Dict, Tuple, Any, Optional, Sequence, Union
 
 class RobustAggregator:
     """
     Server-side aggregator for FedKSeed.
     Reconstructs gradients from seeds and aggregates them using robust statistics.
+    
+    dtype controls the storage precision of the reconstructed (num_clients, num_params) matrix.
+    torch.bfloat16 halves the memory traffic of reconstruction and trimming; scalars are
+    DP-clipped and the noise is unit Gaussian, so the range is safe. Sums are always
+    accumulated in float32 and the aggregate is returned as float32.
     """
-    def __init__(self, prng: Any, shape: Tuple[int], trim_ratio: float = 0.1):
+    def __init__(self, prng: Any, shape: Tuple[int], trim_ratio: float = 0.1, dtype: torch.dtype = torch.float32):
         self.prng = prng
         self.shape = shape
         self.trim_ratio = trim_ratio
+        self.dtype = dtype
 
-    def reconstruct(self, payloads: List[Dict[str, Any]]) -> torch.Tensor:
+    def reconstruct(self, payloads: List[Dict[str, Any]], noise: Optional[torch.Tensor] = None) -> torch.Tensor:
         """
         Reconstructs gradient vectors from client payloads.
         Payload format: {'seed_id': int, 'scalar': float}
+        noise: optional pre-stacked (num_clients, num_params) noise matrix for the payloads' seeds.
         Returns a tensor of shape (num_clients, num_params).
         """
-        gradients = []
-        
-        for payload in payloads:
-            seed_id = payload['seed_id']
-            scalar = payload['scalar']
-            
-            # Generate noise vector (v)
-            v = self.prng.generate_noise_vector(seed_id, self.shape)
-            
-            # Reconstruct gradient approximation (g = scalar * v)
-            g = scalar * v
-            gradients.append(g)
+        seed_ids = [payload['seed_id'] for payload in payloads]
+        scalars = [payload['scalar'] for payload in payloads]
+        return self.reconstruct_columns(seed_ids, scalars, noise=noise)
+
+    def reconstruct_columns(
+        self,
+        seed_ids: Union[Sequence[int], np.ndarray],
+        scalars: Union[Sequence[float], np.ndarray, torch.Tensor],
+        noise: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        """
+        Reconstructs gradient vectors from columnar (SoA) client data.
+        seed_ids[k] and scalars[k] belong to client k.
+        noise: optional pre-stacked noise matrix, row k = noise(seed_ids[k]).
+        Callers that already hold it (e.g. to inspect individual updates) skip regenerating
+        it here; it is read, never modified.
+        Returns a tensor of shape (num_clients, num_params).
+        """
+        if len(seed_ids) == 0:
+            return torch.empty(0, *self.shape, dtype=self.dtype)
             
-        if not gradients:
-            return torch.empty(0, *self.shape)
+        if noise is None:
+            # Generate all noise vectors (V) in one shot: (num_clients, num_params)
+            # Same PRNG path (and device) the clients used for their perturbations;
+            # a torch-backend PRNG on CUDA/MPS generates and scales entirely on the device
+            noise = self.prng.generate_noise_matrix(seed_ids, self.shape)
+            # Freshly generated: scale in place so V is never kept alongside G
+            in_place = True
+        else:
+            if noise.shape != (len(seed_ids), int(np.prod(self.shape))):
+                raise ValueError(
+                    f"noise has shape {tuple(noise.shape)}, expected "
+                    f"({len(seed_ids)}, {int(np.prod(self.shape))})"
+                )
+            in_place = False
             
-        return torch.stack(gradients)
+        noise = noise.to(self.dtype)
+        scalars = torch.as_tensor(scalars, dtype=self.dtype, device=noise.device)
+        
+        # Reconstruct gradient approximations (g_k = scalar_k * v_k) as a single broadcast
+        if in_place:
+            return noise.mul_(scalars.unsqueeze(1))
+        return noise * scalars.unsqueeze(1)
 
     def aggregate(self, gradients: torch.Tensor) -> torch.Tensor:
         """
@@ -43,6 +77,42 @@ class RobustAggregator:
         if gradients.numel() == 0:
             return torch.zeros(self.shape)
             
+        return self._trimmed_mean(gradients)
+
+    def aggregate_stream(
+        self,
+        seed_ids: Union[Sequence[int], np.ndarray],
+        scalars: Union[Sequence[float], np.ndarray, torch.Tensor],
+        block_size: int = 1 << 16
+    ) -> torch.Tensor:
+        """
+        Fused reconstruct_columns + aggregate, streamed over blocks of parameters.
+        Only a (num_clients, block_size) slice of the gradient matrix is alive at a time,
+        instead of the full (num_clients, num_params) matrix.
+        Returns the same result as aggregate(reconstruct_columns(seed_ids, scalars)).
+        """
+        if len(seed_ids) == 0:
+            return torch.zeros(self.shape)
+            
+        numel = int(np.prod(self.shape))
+        result = None
+        scalars = torch.as_tensor(scalars, dtype=self.dtype)
+        
+        for start, noise_block in self.prng.generate_noise_blocks(seed_ids, self.shape, block_size):
+            if result is None:
+                result = torch.empty(numel, dtype=torch.float32, device=noise_block.device)
+                scalars = scalars.to(noise_block.device)
+                
+            # g_k = scalar_k * v_k, restricted to this block of parameters
+            gradient_block = scalars.unsqueeze(1) * noise_block.to(self.dtype)
+            result[start : start + noise_block.shape[1]] = self._trimmed_mean(gradient_block)
+            
+        return result
+
+    def _trimmed_mean(self, gradients: torch.Tensor) -> torch.Tensor:
+        """
+        Coordinate-wise trimmed mean of a (num_clients, n) block, accumulated in float32.
+        """
         num_clients = gradients.shape[0]
         
         # Calculate number of elements to trim from each side
@@ -50,13 +120,18 @@ class RobustAggregator:
         
         if k == 0:
             # Not enough clients to trim, return mean
-            return torch.mean(gradients, dim=0)
+            return torch.mean(gradients, dim=0, dtype=torch.float32)
             
-        # Sort along client dimension
-        sorted_grads, _ = torch.sort(gradients, dim=0)
+        # Partial selection of the k largest / k smallest per coordinate (no full sort)
+        top_idx = torch.topk(gradients, k, dim=0, largest=True).indices
+        # Exclude the top-k positions so ties can't select the same client twice
+        kept = gradients.scatter(0, top_idx, float('inf'))
+        bottom_idx = torch.topk(kept, k, dim=0, largest=False).indices
         
-        # Trim top and bottom k
-        trimmed_grads = sorted_grads[k : num_clients - k]
+        # Zero out trimmed entries rather than subtracting them from the total:
+        # a huge (or inf) adversarial value must not leak into the sum via cancellation.
+        # Done in place on the masked copy: one (num_clients, n) temporary instead of two.
+        kept.scatter_(0, bottom_idx, 0.0).scatter_(0, top_idx, 0.0)
         
-        # Compute mean of remaining
-        return torch.mean(trimmed_grads, dim=0)
+        # Mean of the remaining (num_clients - 2k) values
+        return kept.sum(dim=0, dtype=torch.float32) / (num_clients - 2 * k)
@@ -1,8 +1,18 @@
 import asyncio
+import os
+import numpy as np
+import torch
 import redis.asyncio as redis
-from typing import Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 from cryptography.hazmat.primitives.asymmetric import ed25519
 from cryptography.exceptions import InvalidSignature
+from ruth.server.aggregator import RobustAggregator
+
+# ParseFromString dominates _trigger_aggregation, so deployments should run protobuf's upb (C)
+# backend: the pure-Python one is several times slower. The backend is process-wide and fixed
+# when protobuf is first imported, so it is set in the deployment environment
+# (PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION=upb, see deploy/Dockerfile.server), not here.
 
 # Try to import generated protobuf classes
 try:
@@ -14,20 +24,124 @@ except ImportError:
         class ClientUpdate:
             def SerializeToString(self): return b""
             def ParseFromString(self, data): pass
-            device_id: str
-            round_id: int
-            seed_id: int
-            scalar: float
-            loss: float
-            signature: bytes
-            attestation_token: bytes
+            device_id: str = ""
+            round_id: int = 0
+            seed_id: int = 0
+            scalar: float = 0.0
+            loss: float = 0.0
+            signature: bytes = b""
+            attestation_token: bytes = b""
+
+# Sorted set of round_id -> pending update count, maintained by submit_update.
+# Lets the worker query only rounds that crossed the threshold instead of scanning every counter.
+ROUNDS_READY_KEY = "ruth:rounds_ready"
+
+ED25519_SIGNATURE_SIZE = 64
+
+# DECRBY a round's pending counter and delete it once drained, so finished rounds
+# don't leave a "0" key behind. Returns the remaining count.
+DRAIN_COUNT_SCRIPT = """
+local remaining = redis.call('DECRBY', KEYS[1], ARGV[1])
+if remaining <= 0 then
+    redis.call('DEL', KEYS[1])
+end
+return remaining
+"""
+
+# Process-wide connection pools keyed by (url, password): aggregators are round-scoped,
+# and sharing the pool keeps their sockets (and TLS/AUTH) alive across rounds.
+# redis.asyncio connections belong to the event loop that opened them, so share within one loop.
+_POOLS: Dict[Tuple[str, Optional[str]], redis.ConnectionPool] = {}
+
+# Process-wide executor for protobuf deserialization and reconstruction, shared by every
+# aggregator (each round submits one task of each); created on first use, shut down by close_pools.
+_PARSE_POOL: Optional[ThreadPoolExecutor] = None
+
+def _get_pool(redis_url: str, password: Optional[str] = None) -> redis.ConnectionPool:
+    key = (redis_url, password)
+    pool = _POOLS.get(key)
+    if pool is None:
+        pool = redis.ConnectionPool.from_url(redis_url, password=password)
+        _POOLS[key] = pool
+    return pool
+
+def _get_parse_pool() -> ThreadPoolExecutor:
+    global _PARSE_POOL
+    if _PARSE_POOL is None:
+        _PARSE_POOL = ThreadPoolExecutor(max_workers=os.cpu_count())
+    return _PARSE_POOL
+
+async def close_pools() -> None:
+    """Disconnects every shared pool and shuts down the parse pool (e.g. at server shutdown)."""
+    global _PARSE_POOL
+    if _PARSE_POOL is not None:
+        _PARSE_POOL.shutdown(wait=True)
+        _PARSE_POOL = None
+    pools = list(_POOLS.values())
+    _POOLS.clear()
+    for pool in pools:
+        await pool.disconnect()
+
+def _parse_batch(serialized_updates: List[bytes]) -> List[Any]:
+    """
+    Deserializes a batch of ClientUpdate blobs.
+    Runs in the parse pool so protobuf CPU work stays off the event loop thread.
+    """
+    parsed_updates = []
+    for data in serialized_updates:
+        update = ruth_pb2.ClientUpdate()
+        update.ParseFromString(data)
+        parsed_updates.append(update)
+    return parsed_updates
+
+def _to_columns(parsed_updates: List[Any]) -> Dict[str, np.ndarray]:
+    """
+    Converts parsed ClientUpdates (AoS) into columnar arrays (SoA), in a single pass.
+    columns[name][k] belongs to update k; signatures is a (K, 64) uint8 matrix
+    (malformed signatures are left zero-padded and will fail verification).
+    """
+    num_updates = len(parsed_updates)
+    seed_ids = np.empty(num_updates, dtype=np.uint64)
+    round_ids = np.empty(num_updates, dtype=np.uint64)
+    scalars = np.empty(num_updates, dtype=np.float32)
+    losses = np.empty(num_updates, dtype=np.float32)
+    signatures = np.zeros((num_updates, ED25519_SIGNATURE_SIZE), dtype=np.uint8)
+    
+    for k, update in enumerate(parsed_updates):
+        seed_ids[k] = update.seed_id
+        round_ids[k] = update.round_id
+        scalars[k] = update.scalar
+        losses[k] = update.loss
+        signature = np.frombuffer(update.signature, dtype=np.uint8)[:ED25519_SIGNATURE_SIZE]
+        signatures[k, :len(signature)] = signature
+        
+    return {
+        "seed_ids": seed_ids,
+        "round_ids": round_ids,
+        "scalars": scalars,
+        "losses": losses,
+        "signatures": signatures,
+    }
+
+def _aggregate_columns(aggregator: RobustAggregator, columns: Dict[str, np.ndarray]) -> torch.Tensor:
+    """Reconstructs and robustly aggregates one round straight from its columns."""
+    gradients = aggregator.reconstruct_columns(columns["seed_ids"], columns["scalars"])
+    return aggregator.aggregate(gradients)
 
 class AsyncAggregator:
-    def __init__(self, redis_url: str, k_threshold: int):
-        # Use Connection Pool for efficiency
-        self.pool = redis.ConnectionPool.from_url(redis_url)
+    def __init__(
+        self,
+        redis_url: str,
+        k_threshold: int,
+        password: Optional[str] = None,
+        aggregator: Optional[RobustAggregator] = None,
+    ):
+        # Use the shared Connection Pool for this URL (see _get_pool)
+        self.pool = _get_pool(redis_url, password)
         self.redis = redis.Redis(connection_pool=self.pool)
         self.k_threshold = k_threshold
+        # Reconstructs + aggregates drained rounds; without one, rounds are drained but not aggregated
+        self.aggregator = aggregator
         self.running = False
         self.task = None
 
@@ -67,6 +181,8 @@ class AsyncAggregator:
                 await pipe.lpush(updates_key, serialized_data)
                 # INCR the counter
                 await pipe.incr(count_key)
+                # Mirror the counter as the round's score in the ready set
+                await pipe.zincrby(ROUNDS_READY_KEY, 1, str(round_id))
                 # Execute atomic block
                 await pipe.execute()
         except redis.RedisError as e:
@@ -85,9 +201,8 @@ class AsyncAggregator:
         self.running = False
         if self.task:
             await self.task
-        # Close pool
+        # Release this client; the shared pool stays up for other aggregators (see close_pools)
         await self.redis.close()
-        await self.pool.disconnect()
 
     async def _worker_loop(self):
         """
@@ -96,32 +211,20 @@ class AsyncAggregator:
         print("AsyncAggregator worker started.")
         while self.running:
             try:
-                # Scan for active rounds
-                # In production, we'd use SCAN or a set of active rounds
-                # For efficiency, let's assume we maintain a set "ruth:active_rounds"
-                # But to stick to the prompt's simplicity on keys:
+                # Only rounds whose pending count reached the threshold
+                ready = await self.redis.zrangebyscore(
+                    ROUNDS_READY_KEY, self.k_threshold, "+inf", withscores=True
+                )
                 
-                # Use SCAN to find keys matching pattern
-                # This is better than KEYS which blocks
-                cursor = b'0'
-                while cursor:
-                    cursor, keys = await self.redis.scan(cursor, match="ruth:round:*:count", count=100)
-                    for key in keys:
-                        key_str = key.decode('utf-8')
-                        # key format: ruth:round:{round_id}:count
-                        try:
-                            round_id = int(key_str.split(':')[2])
-                            
-                            count = int(await self.redis.get(key_str) or 0)
-                            
-                            if count >= self.k_threshold:
-                                print(f"Threshold reached for round {round_id} (Count: {count}). Aggregating...")
-                                await self._trigger_aggregation(round_id)
-                        except (IndexError, ValueError):
-                            continue
-                            
-                    if cursor == b'0':
-                        break
+                for member, score in ready:
+                    try:
+                        round_id = int(member)
+                        count = int(score)
+                    except (TypeError, ValueError):
+                        continue
+                        
+                    print(f"Threshold reached for round {round_id} (Count: {count}). Aggregating...")
+                    await self._trigger_aggregation(round_id, count)
                 
                 await asyncio.sleep(1.0) # Poll interval
                 
@@ -129,40 +232,53 @@ class AsyncAggregator:
                 print(f"Worker error: {e}")
                 await asyncio.sleep(1.0)
 
-    async def _trigger_aggregation(self, round_id: int):
+    async def _trigger_aggregation(self, round_id: int, count: int) -> Optional[torch.Tensor]:
         """
-        Loads updates from Redis, performs aggregation, and cleans up.
+        Atomically drains `count` updates from Redis and performs aggregation.
+        Returns the round's aggregated gradient (None without an aggregator or on error).
+        Drained updates are not re-queued: if a batch fails to parse, its updates
+        are dropped (a malformed blob would otherwise be retried forever).
         """
         updates_key = f"ruth:round:{round_id}:updates"
         count_key = f"ruth:round:{round_id}:count"
         
         try:
-            # 1. Load all updates
-            serialized_updates = await self.redis.lrange(updates_key, 0, -1)
+            # 1. Drain the counted updates
+            # Pop + counter decrements run in one transaction, so an update submitted
+            # concurrently is either drained here or left (and counted) for the next pass.
+            # RPOP takes the oldest entries first (submit_update LPUSHes).
+            async with self.redis.pipeline(transaction=True) as pipe:
+                await pipe.rpop(updates_key, count)
+                await pipe.eval(DRAIN_COUNT_SCRIPT, 1, count_key, count)
+                await pipe.zincrby(ROUNDS_READY_KEY, -count, str(round_id))
+                # Drop fully drained rounds from the ready set
+                await pipe.zremrangebyscore(ROUNDS_READY_KEY, "-inf", 0)
+                results = await pipe.execute()
+                
+            serialized_updates = results[0] or []
             
             print(f"Loaded {len(serialized_updates)} updates for round {round_id}.")
             
-            parsed_updates = []
-            for data in serialized_updates:
-                update = ruth_pb2.ClientUpdate()
-                update.ParseFromString(data)
-                parsed_updates.append(update)
+            loop = asyncio.get_running_loop()
+            parsed_updates = await loop.run_in_executor(_get_parse_pool(), _parse_batch, serialized_updates)
             
-            # 2. Perform Aggregation (Mock call to RobustAggregator)
-            # In a real app, we'd call the aggregator logic here
-            # aggregator = RobustAggregator(...)
-            # result = aggregator.aggregate(parsed_updates)
-            
-            # 3. Cleanup
-            # Use pipeline for atomic cleanup
-            async with self.redis.pipeline(transaction=True) as pipe:
-                await pipe.delete(updates_key)
-                await pipe.delete(count_key)
-                await pipe.execute()
+            if self.aggregator is None:
+                print(f"Round {round_id}: no aggregator configured, skipping aggregation.")
+                return None
                 
-            print(f"Round {round_id} aggregation complete. Keys cleared.")
+            # 2. Perform Aggregation
+            # Columnar view: the aggregator reads whole arrays, not per-object fields.
+            # Reconstruction is CPU-bound too, so it also runs off the event loop thread
+            columns = _to_columns(parsed_updates)
+            global_grad = await loop.run_in_executor(
+                _get_parse_pool(), _aggregate_columns, self.aggregator, columns
+            )
+            
+            print(f"Round {round_id} aggregation complete.")
+            return global_grad
             
         except redis.RedisError as e:
             print(f"Redis error during aggregation: {e}")
         except Exception as e:
-            print(f"Aggregation error: {e}")
+            print(f"Aggregation error (round {round_id} updates dropped): {e}")
+        return None
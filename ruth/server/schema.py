@@ -1,5 +1,25 @@
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+import math
+import struct
+
+from pydantic import BaseModel, model_validator
+from typing import List, Dict, Any, Literal, Optional
+
+# Largest finite float32; anything above it (and the top float32s) rounds to bf16 infinity
+FLT_MAX = struct.unpack("<f", struct.pack("<I", 0x7F7FFFFF))[0]
+
+def to_bf16(value: float) -> float:
+    """
+    Rounds a float to the nearest bfloat16 (round-to-nearest-even), returned
+    as a Python float. Matches torch's float32 -> bfloat16 conversion;
+    magnitudes beyond float32 range saturate to +/-inf.
+    """
+    if math.isnan(value):
+        return value
+    if abs(value) > FLT_MAX:
+        return math.copysign(math.inf, value)
+    bits = struct.unpack("<I", struct.pack("<f", value))[0]
+    bits = (bits + 0x7FFF + ((bits >> 16) & 1)) & 0xFFFF0000
+    return struct.unpack("<f", struct.pack("<I", bits))[0]
 
 class SeedSet(BaseModel):
     """
@@ -15,12 +35,26 @@ class ScalarUpload(BaseModel):
     """
     Uplink message from Client to Server.
     Contains the gradient estimate scalar and metadata.
+    With scalar_dtype="bf16" the scalar is rounded to bf16 precision, mirroring
+    production FL compression (the field itself is still sent as a float); it
+    is already clipped, so the rounding error is negligible next to the ZO
+    estimate's own variance. Finite scalars that overflow bf16 are rejected.
     """
     round_id: int
     seed_id: int
     scalar: float
     loss_local: float
     attestation_token: Optional[str] = None
+    scalar_dtype: Literal["fp32", "bf16"] = "fp32"
+
+    @model_validator(mode="after")
+    def _quantize_scalar(self):
+        if self.scalar_dtype == "bf16":
+            rounded = to_bf16(self.scalar)
+            if math.isinf(rounded) and not math.isinf(self.scalar):
+                raise ValueError(f"scalar {self.scalar} overflows bf16")
+            self.scalar = rounded
+        return self
 
 class AggResponse(BaseModel):
     """
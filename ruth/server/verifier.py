@@ -1,15 +1,123 @@
+import asyncio
+import base64
 import hashlib
+import hmac
+import http.client
 import json
+import logging
 import os
-import urllib.request
-import urllib.error
-from typing import Any, Dict, Optional
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
 from cryptography.hazmat.primitives.asymmetric import ed25519
 from cryptography.exceptions import InvalidSignature
 
+logger = logging.getLogger(__name__)
+
+# Signed payload: little-endian (seed_id: u64, scalar: f64, round_id: u64), 24 bytes.
+# Must match the client signer (ruth.client.security).
+_PAYLOAD_FMT = struct.Struct("<QdQ")
+# Same layout as a numpy record, for packing whole columns at once
+_PAYLOAD_DTYPE = np.dtype([("seed_id", "<u8"), ("scalar", "<f8"), ("round_id", "<u8")])
+
+def _payload_bytes(seed_id: int, scalar: float, round_id: int) -> bytes:
+    """Canonical signed payload: one SHA-256 block, no string formatting."""
+    return _PAYLOAD_FMT.pack(seed_id, scalar, round_id)
+
+def _update_payload(update: Any) -> Optional[bytes]:
+    """
+    _payload_bytes for a ClientUpdate, or None if its fields can't be packed
+    (negative / out-of-range ids, wrong types): such an update can't carry a valid signature.
+    """
+    try:
+        return _payload_bytes(update.seed_id, update.scalar, update.round_id)
+    except struct.error as e:
+        logger.warning("Malformed update payload: %s", e)
+        return None
+
+ATTESTATION_HOST = "www.googleapis.com"
+ATTESTATION_TIMEOUT = 5.0
+# Cap on in-flight attestation requests from the async paths (API rate limit)
+ATTESTATION_MAX_CONCURRENCY = 64
+# Successful (token, nonce) verdicts are reused for this long instead of re-asking the API
+ATTESTATION_CACHE_TTL = 60.0
+ATTESTATION_CACHE_SIZE = 100_000
+
+# Request body template: the token is the only variable field
+_ATTEST_BODY_PREFIX = b'{"signedAttestation": "'
+_ATTEST_BODY_SUFFIX = b'"}'
+# Bytes that would need escaping inside a JSON string (or aren't plain ASCII)
+_JSON_UNSAFE = re.compile(rb'["\\\x00-\x1f\x7f-\xff]')
+
+def _attestation_body(token_bytes: bytes) -> bytes:
+    """
+    Serializes {"signedAttestation": token}. Tokens are base64 / JWS, so they are spliced
+    into the template verbatim; anything needing escaping goes through json.dumps.
+    """
+    if _JSON_UNSAFE.search(token_bytes) is None:
+        return _ATTEST_BODY_PREFIX + token_bytes + _ATTEST_BODY_SUFFIX
+    return json.dumps({"signedAttestation": token_bytes.decode('utf-8')}).encode('utf-8')
+
+# Parsed device keys, reused across rounds. Sized above the expected fleet so
+# steady-state rounds never re-decode a key.
+PUBLIC_KEY_CACHE_SIZE = 65536
+
+@lru_cache(maxsize=PUBLIC_KEY_CACHE_SIZE)
+def _load_public_key(public_key_bytes: bytes) -> ed25519.Ed25519PublicKey:
+    return ed25519.Ed25519PublicKey.from_public_bytes(public_key_bytes)
+
+def attestation_nonce(payload: bytes) -> str:
+    """
+    Nonce an attestation must carry for a payload: base64(SHA-256(payload)).
+    Matches the encoding the attestation API returns, so verdicts compare as plain strings.
+    """
+    return base64.b64encode(hashlib.sha256(payload).digest()).decode('ascii')
+
+def _nonce_matches(returned_nonce: Any, expected_nonce: str) -> bool:
+    """Constant-time nonce compare; anything that isn't an ASCII string is a mismatch."""
+    return (
+        isinstance(returned_nonce, str)
+        and returned_nonce.isascii()
+        and hmac.compare_digest(returned_nonce, expected_nonce)
+    )
+
+def attestation_nonces(payloads: Sequence[bytes]) -> List[str]:
+    """
+    attestation_nonce for each of a round's payloads, in order.
+    hashlib's OpenSSL backend already selects the SHA-NI / ARMv8 SHA2 instructions
+    where the CPU has them.
+    """
+    return [attestation_nonce(payload) for payload in payloads]
+
+def _split_rows(matrix: np.ndarray) -> List[bytes]:
+    """Splits a C-contiguous (N, width) uint8 matrix into N bytes objects from one buffer."""
+    blob = matrix.tobytes()
+    width = matrix.shape[1]
+    return [blob[i * width:(i + 1) * width] for i in range(matrix.shape[0])]
+
 class Gatekeeper:
     def __init__(self):
         self.api_key = os.environ.get("GOOGLE_API_KEY", "mock_api_key")
+        # API Endpoint (as per prompt); formatted once, not per update
+        self._attest_path = f"/androidcheck/v1/attestations:verify?key={self.api_key}"
+        # Keep-alive HTTPS connections, opened lazily and reused across updates
+        # so only the first verification pays the TCP + TLS handshake.
+        # One per thread: http.client connections are not thread-safe.
+        self._local = threading.local()
+        self._connections: List[http.client.HTTPSConnection] = []
+        self._connections_lock = threading.Lock()
+        # Worker pool for the async paths; its size bounds outbound concurrency
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # blake2b(token) -> (nonce, expiry). Only positive verdicts are stored, so a transient
+        # API or network failure is never pinned. Insertion order == expiry order (fixed TTL).
+        self._attest_cache: "OrderedDict[bytes, Tuple[str, float]]" = OrderedDict()
+        self._attest_cache_lock = threading.Lock()
 
     def verify_update(self, update: Any, public_key_bytes: bytes) -> bool:
         """
@@ -23,50 +131,144 @@ class Gatekeeper:
             True if valid, False otherwise.
         """
         # 1. Verify Ed25519 Signature
-        try:
-            public_key = ed25519.Ed25519PublicKey.from_public_bytes(public_key_bytes)
-            # Reconstruct payload: "{seed_id}:{scalar}:{round_id}"
-            payload_str = f"{update.seed_id}:{update.scalar}:{update.round_id}"
-            payload = payload_str.encode('utf-8')
-            
-            public_key.verify(update.signature, payload)
-        except (InvalidSignature, ValueError) as e:
-            print(f"Signature verification failed: {e}")
+        payload = _update_payload(update)
+        if payload is None or not self._verify_signature(payload, update.signature, public_key_bytes):
             return False
             
         # 2. Verify Attestation
         # We verify the attestation token against the Google API
-        # The nonce in the attestation should match SHA256(payload)
-        expected_nonce = hashlib.sha256(payload).hexdigest()
+        # The nonce in the attestation should match base64(SHA256(payload))
+        expected_nonce = attestation_nonce(payload)
         
         if not self._verify_attestation(update.attestation_token, expected_nonce):
-            print("Attestation verification failed.")
+            logger.warning("Attestation verification failed.")
             return False
             
         return True
 
-    def _verify_attestation(self, token_bytes: bytes, expected_nonce: str) -> bool:
+    async def verify_update_async(self, update: Any, public_key_bytes: bytes) -> bool:
         """
-        Verifies the attestation token using the Google API.
+        verify_update without blocking the event loop: runs on the Gatekeeper's worker pool,
+        at most ATTESTATION_MAX_CONCURRENCY at a time, each thread on its own keep-alive connection.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(ATTESTATION_MAX_CONCURRENCY, thread_name_prefix="attestation")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.verify_update, update, public_key_bytes)
+
+    async def verify_batch_async(self, updates: Sequence[Any], public_keys: Sequence[bytes]) -> List[bool]:
+        """
+        Concurrent verify_update over a round; result[i] belongs to updates[i].
         """
-        token = token_bytes.decode('utf-8')
+        if len(updates) != len(public_keys):
+            raise ValueError("updates and public_keys must have the same length")
+            
+        return list(await asyncio.gather(
+            *(self.verify_update_async(update, public_key) for update, public_key in zip(updates, public_keys))
+        ))
+
+    def verify_batch(self, updates: Sequence[Any], public_keys: Sequence[bytes]) -> List[bool]:
+        """
+        Verifies a round's worth of updates; result[i] is verify_update(updates[i], public_keys[i]).
         
-        # API Endpoint (as per prompt)
-        url = f"https://www.googleapis.com/androidcheck/v1/attestations:verify?key={self.api_key}"
+        Not batch verification: each signature and each attestation is still checked one at a
+        time, so this costs the same as calling verify_update in a loop. It only orders the work:
+        all signatures are checked first, so the (network-bound) attestation calls are only
+        made for updates whose signature already verified.
+        """
+        if len(updates) != len(public_keys):
+            raise ValueError("updates and public_keys must have the same length")
+            
+        # Unpackable updates (None) fail on their own without aborting the round
+        payloads = [_update_payload(u) for u in updates]
+        return self._verify_rows(
+            payloads,
+            [u.signature for u in updates],
+            public_keys,
+            [u.attestation_token for u in updates],
+        )
+
+    def verify_batch_soa(self, columns: Dict[str, Any]) -> List[bool]:
+        """
+        verify_batch over columnar (SoA) updates, without per-update objects.
         
-        # Payload
-        data = {
-            "signedAttestation": token
-        }
-        json_data = json.dumps(data).encode('utf-8')
+        Args:
+            columns: "seed_ids", "scalars", "round_ids" (1-D arrays, N), "signatures" (uint8, (N, 64)),
+                "public_keys" (uint8, (N, 32)) and "attestation_tokens" (N bytes objects).
+                scalars are packed as float64, so they must hold the exact values that were signed.
+                
+        Returns:
+            One bool per row.
+        """
+        seed_ids = np.asarray(columns["seed_ids"])
+        scalars = np.asarray(columns["scalars"])
+        round_ids = np.asarray(columns["round_ids"])
+        signatures = np.ascontiguousarray(columns["signatures"], dtype=np.uint8)
+        public_keys = np.ascontiguousarray(columns["public_keys"], dtype=np.uint8)
+        tokens = columns["attestation_tokens"]
         
-        req = urllib.request.Request(
-            url,
-            data=json_data,
-            headers={'Content-Type': 'application/json'}
-        )
+        num_updates = len(seed_ids)
+        if not (len(scalars) == len(round_ids) == len(signatures) == len(public_keys) == len(tokens) == num_updates):
+            raise ValueError("all columns must have the same length")
+            
+        # Pack all payloads as one record array: three column copies instead of N format calls
+        records = np.empty(num_updates, dtype=_PAYLOAD_DTYPE)
+        records["seed_id"] = seed_ids
+        records["scalar"] = scalars
+        records["round_id"] = round_ids
+        payloads = _split_rows(records.view(np.uint8).reshape(num_updates, _PAYLOAD_DTYPE.itemsize))
+        
+        return self._verify_rows(payloads, _split_rows(signatures), _split_rows(public_keys), tokens)
+
+    def _verify_rows(
+        self,
+        payloads: Sequence[Optional[bytes]],
+        signatures: Sequence[bytes],
+        public_keys: Sequence[bytes],
+        tokens: Sequence[bytes],
+    ) -> List[bool]:
+        # One Ed25519 verify per row (cryptography has no batch verification API)
+        signed = [
+            i for i, (payload, signature, public_key) in enumerate(zip(payloads, signatures, public_keys))
+            if payload is not None and self._verify_signature(payload, signature, public_key)
+        ]
         
+        # Nonces only for the payloads whose signature verified
+        nonces = attestation_nonces([payloads[i] for i in signed])
+        
+        results = [False] * len(payloads)
+        for i, expected_nonce in zip(signed, nonces):
+            ok = self._verify_attestation(tokens[i], expected_nonce)
+            if not ok:
+                logger.warning("Attestation verification failed.")
+            results[i] = ok
+        return results
+
+    def _verify_signature(self, payload: bytes, signature: bytes, public_key_bytes: bytes) -> bool:
+        """
+        Checks the Ed25519 signature over the update payload.
+        """
+        try:
+            public_key = _load_public_key(bytes(public_key_bytes))
+            public_key.verify(signature, payload)
+        except (InvalidSignature, ValueError) as e:
+            logger.warning("Signature verification failed: %s", e)
+            return False
+        return True
+
+    def _verify_attestation(self, token_bytes: bytes, expected_nonce: str) -> bool:
+        """
+        Verifies the attestation token using the Google API.
+        """
+        token_bytes = bytes(token_bytes)
+        cache_key = hashlib.blake2b(token_bytes, digest_size=16).digest()
+        if self._cached_attestation(cache_key, expected_nonce):
+            return True
+            
         try:
+            # Inside the try: a token that isn't valid UTF-8 fails verification like any other
+            json_data = _attestation_body(token_bytes)
+            
             # In a real environment, this would make a network call.
             # For this exercise, we implement the call but expect it might fail 
             # or return a mock response if we were mocking the network layer.
@@ -79,60 +281,113 @@ class Gatekeeper:
             # But to avoid breaking the user's environment if they run this, 
             # I will wrap it.
             
-            with urllib.request.urlopen(req, timeout=5) as response:
-                if response.status != 200:
-                    print(f"Attestation API returned status {response.status}")
-                    return False
-                    
-                body = response.read()
-                result = json.loads(body)
+            status, body = self._post_attestation(json_data)
+            if status != 200:
+                logger.warning("Attestation API returned status %s", status)
+                # For the sake of the exercise, if we get a 400/403 (likely due to mock key),
+                # we fail secure.
+                return False
                 
-                # Parse Response (SafetyNet structure)
-                # { "isValidSignature": true, "evaluationType": "BASIC", "nonce": "..." }
+            result = json.loads(body)
+            
+            # Parse Response (SafetyNet structure)
+            # { "isValidSignature": true, "evaluationType": "BASIC", "nonce": "..." }
+            
+            if not result.get("isValidSignature", False):
+                logger.warning("Attestation signature invalid.")
+                return False
                 
-                if not result.get("isValidSignature", False):
-                    print("Attestation signature invalid.")
-                    return False
-                    
-                # Verify Nonce
-                # Note: SafetyNet nonce is base64 encoded. Our expected_nonce is hex.
-                # We need to handle encoding matching.
-                # Assuming the API returns the nonce we sent.
-                returned_nonce = result.get("nonce")
-                # In reality, we'd decode base64 and compare.
-                # For this implementation, let's assume strict equality or decoding.
-                # Let's try to match loosely for robustness in this snippet.
-                if returned_nonce != expected_nonce:
-                     # Try base64 decoding the returned nonce
-                    try:
-                        import base64
-                        decoded_nonce = base64.b64decode(returned_nonce).hex()
-                        if decoded_nonce != expected_nonce:
-                             print(f"Nonce mismatch. Expected {expected_nonce}, got {decoded_nonce}")
-                             return False
-                    except:
-                        if returned_nonce != expected_nonce:
-                            print(f"Nonce mismatch. Expected {expected_nonce}, got {returned_nonce}")
-                            return False
-
-                # Verify Integrity (Basic Integrity)
-                # Note: The prompt mentioned "MEETS_STRONG_INTEGRITY" which is Play Integrity.
-                # But the URL is SafetyNet. SafetyNet uses "basicIntegrity": true.
-                # I will check for basicIntegrity.
-                if not result.get("basicIntegrity", False):
-                    print("Device failed basic integrity check.")
-                    return False
-                    
-                return True
+            # Verify Nonce
+            # SafetyNet returns the nonce base64 encoded; expected_nonce is already
+            # base64(SHA256(payload)), so this is a straight (constant-time) string compare
+            returned_nonce = result.get("nonce")
+            if not _nonce_matches(returned_nonce, expected_nonce):
+                logger.debug("Nonce mismatch. Expected %s, got %s", expected_nonce, returned_nonce)
+                return False
+
+            # Verify Integrity (Basic Integrity)
+            # Note: The prompt mentioned "MEETS_STRONG_INTEGRITY" which is Play Integrity.
+            # But the URL is SafetyNet. SafetyNet uses "basicIntegrity": true.
+            # I will check for basicIntegrity.
+            if not result.get("basicIntegrity", False):
+                logger.warning("Device failed basic integrity check.")
+                return False
                 
-        except urllib.error.HTTPError as e:
-            print(f"Attestation API HTTP Error: {e.code} {e.reason}")
-            # For the sake of the exercise, if we get a 400/403 (likely due to mock key),
-            # we might want to fail secure.
-            return False
-        except urllib.error.URLError as e:
-            print(f"Attestation API Network Error: {e.reason}")
+            self._cache_attestation(cache_key, expected_nonce)
+            return True
+            
+        except (http.client.HTTPException, OSError) as e:
+            logger.warning("Attestation API Network Error: %s", e)
             return False
         except Exception as e:
-            print(f"Attestation Verification Error: {e}")
+            logger.exception("Attestation Verification Error: %s", e)
             return False
+
+    def _cached_attestation(self, cache_key: bytes, expected_nonce: str) -> bool:
+        now = time.monotonic()
+        with self._attest_cache_lock:
+            # Expire from the old end
+            while self._attest_cache:
+                oldest = next(iter(self._attest_cache.values()))
+                if oldest[1] > now:
+                    break
+                self._attest_cache.popitem(last=False)
+            entry = self._attest_cache.get(cache_key)
+        return entry is not None and _nonce_matches(entry[0], expected_nonce)
+
+    def _cache_attestation(self, cache_key: bytes, nonce: str) -> None:
+        with self._attest_cache_lock:
+            self._attest_cache.pop(cache_key, None)
+            self._attest_cache[cache_key] = (nonce, time.monotonic() + ATTESTATION_CACHE_TTL)
+            if len(self._attest_cache) > ATTESTATION_CACHE_SIZE:
+                self._attest_cache.popitem(last=False)
+
+    def _post_attestation(self, json_data: bytes) -> Tuple[int, bytes]:
+        """
+        POSTs the attestation request over the persistent connection and returns (status, body).
+        A connection the server has closed while idle is reopened and the request retried once.
+        """
+        headers = {'Content-Type': 'application/json'}
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request("POST", self._attest_path, body=json_data, headers=headers)
+                response = conn.getresponse()
+                # Drain the body so the connection can be reused
+                return response.status, response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self._drop_connection()
+                if attempt:
+                    raise
+            except Exception:
+                self._drop_connection()
+                raise
+
+    def _connection(self) -> http.client.HTTPSConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPSConnection(ATTESTATION_HOST, timeout=ATTESTATION_TIMEOUT)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _drop_connection(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+            with self._connections_lock:
+                self._connections.remove(conn)
+
+    def close(self) -> None:
+        """Closes all pooled attestation connections and the async worker pool (recreated on next use)."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        # Every thread opens a fresh connection on its next request
+        self._local = threading.local()
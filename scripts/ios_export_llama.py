@@ -1,7 +1,9 @@
+import argparse
 import torch
 import torch.nn as nn
 import os
 import logging
+from typing import Optional, Union
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -26,7 +28,7 @@ except ImportError:
     AutoModelForCausalLM = None
 
 try:
-    from torchao.quantization import quantize_, int4_weight_only
+    from torchao.quantization import quantize_, int4_weight_only, int8_weight_only
 except ImportError:
     logger.warning("TorchAO not found. Quantization will be skipped.")
     quantize_ = None
@@ -35,6 +37,9 @@ class RuthLlamaEdge(nn.Module):
     def __init__(self, model):
         super().__init__()
         self.model = model
+        # Reused across forward_perturb calls (re-seeded each time); created on first use
+        # so it lives on whatever device the inputs end up on
+        self._gen: Optional[torch.Generator] = None
         
     def forward(self, input_ids: torch.Tensor) -> torch.Tensor:
         """
@@ -45,11 +50,14 @@ class RuthLlamaEdge(nn.Module):
         outputs = self.model(input_ids)
         return outputs.logits
 
-    def forward_perturb(self, input_ids: torch.Tensor, labels: torch.Tensor, seed: torch.Tensor, epsilon: float) -> torch.Tensor:
+    def forward_perturb(
+        self, input_ids: torch.Tensor, labels: torch.Tensor, seed: Union[int, torch.Tensor], epsilon: float
+    ) -> torch.Tensor:
         """
         Forward pass with perturbation for training.
         W' = W + epsilon * v
         v is generated deterministically from seed.
+        Pass seed as a host int to skip the device->host sync of reading a seed tensor.
         """
         # Note: Generating 1B params of noise on device is expensive.
         # Ideally, this uses a custom op or a very efficient PRNG.
@@ -77,12 +85,10 @@ class RuthLlamaEdge(nn.Module):
         # IMPORTANT: For the sake of the graph trace, we need to show dependence on 'seed'.
         # We'll use a pseudo-random generator seeded by 'seed'.
         
-        gen = torch.Generator(device=input_ids.device)
-        gen.manual_seed(int(seed.item()))
-        
-        # We'll use functional_call to apply perturbations statelessly
-        from torch.func import functional_call
+        gen = self._generator(input_ids.device)
+        gen.manual_seed(int(seed.item()) if isinstance(seed, torch.Tensor) else int(seed))
         
+        # We'll use functional_call (see _functional_logits) to apply perturbations statelessly
         params = dict(self.model.named_parameters())
         perturbed_params = {}
         
@@ -98,26 +104,105 @@ class RuthLlamaEdge(nn.Module):
                 # In real life: v = torch.randn(param.shape, generator=gen, device=param.device)
                 v = torch.randn(param.shape, generator=gen, device=param.device)
                 
-                perturbed_params[name] = param + epsilon * v
+                # W' = epsilon * v + W written into v's storage: one weight-sized
+                # buffer per layer instead of separate noise, scaled and sum tensors
+                perturbed_params[name] = v.mul_(epsilon).add_(param)
                 count += 1
             else:
                 perturbed_params[name] = param
                 
         # Run functional forward
         # We need to wrap self.model call
-        logits = functional_call(self.model, perturbed_params, (input_ids,))
+        logits = self._functional_logits(perturbed_params, input_ids)
         
         # Compute loss
         # Shift logits and labels for Causal LM loss
-        shift_logits = logits[..., :-1, :].contiguous()
-        shift_labels = labels[..., 1:].contiguous()
-        loss = nn.functional.cross_entropy(shift_logits.view(-1, shift_logits.size(-1)), shift_labels.view(-1))
+        # reshape instead of .contiguous() + view: no copy when the slice is already
+        # flattenable (batch size 1), at most one copy otherwise
+        shift_logits = logits[..., :-1, :]
+        shift_labels = labels[..., 1:]
+        loss = nn.functional.cross_entropy(shift_logits.reshape(-1, shift_logits.size(-1)), shift_labels.reshape(-1))
         
         return loss
 
-def export_llama(output_path: str = "ruth_llama_1b_mps.pte"):
+    def forward_perturb_batch(
+        self, input_ids: torch.Tensor, labels: torch.Tensor, seeds: torch.Tensor, epsilons: torch.Tensor, limit: int = 5
+    ) -> torch.Tensor:
+        """
+        K perturbed forward passes in one vmapped call: losses[k] == forward_perturb(input_ids, labels, seeds[k], epsilons[k]).
+        The K copies of each perturbed weight are stacked on a leading dim, so every layer runs
+        as one batched matmul instead of K small ones.
+        
+        Args:
+            seeds: Shape (K,), one PRNG seed per perturbation.
+            epsilons: Shape (K,), perturbation scale per seed.
+            limit: Number of trainable tensors to perturb (same subset as forward_perturb).
+            
+        Returns:
+            Loss per perturbation, shape (K,).
+        """
+        from torch.func import vmap
+        
+        # One generator per seed, advanced over the parameters in the same order as
+        # forward_perturb, so slice k of every stack matches the single-seed noise
+        gens = []
+        for seed in seeds.tolist():
+            gen = torch.Generator(device=input_ids.device)
+            gen.manual_seed(int(seed))
+            gens.append(gen)
+            
+        static_params = {}
+        perturbed_stack = {}
+        count = 0
+        for name, param in self.model.named_parameters():
+            if param.requires_grad and count < limit:
+                v_stack = torch.stack([torch.randn(param.shape, generator=gen, device=param.device) for gen in gens])
+                # Match the noise dtype, not the (possibly fp16) weight: forward_perturb scales by
+                # the Python-float epsilon, so rounding it to the weight dtype would diverge
+                scale = epsilons.to(v_stack.dtype).view(-1, *([1] * param.dim()))
+                perturbed_stack[name] = v_stack.mul_(scale).add_(param)
+                count += 1
+            else:
+                static_params[name] = param
+                
+        def perturbed_loss(perturbed_params: dict) -> torch.Tensor:
+            # Unperturbed weights are closed over, so vmap never copies them K times
+            logits = self._functional_logits({**static_params, **perturbed_params}, input_ids)
+            shift_logits = logits[..., :-1, :]
+            shift_labels = labels[..., 1:]
+            return nn.functional.cross_entropy(shift_logits.reshape(-1, shift_logits.size(-1)), shift_labels.reshape(-1))
+            
+        return vmap(perturbed_loss)(perturbed_stack)
+
+    def _generator(self, device: torch.device) -> torch.Generator:
+        if self._gen is None or self._gen.device != device:
+            self._gen = torch.Generator(device=device)
+        return self._gen
+
+    def _functional_logits(self, params: dict, input_ids: torch.Tensor) -> torch.Tensor:
+        from torch.func import functional_call
+        
+        outputs = functional_call(self.model, params, (input_ids,))
+        # Causal LMs return CausalLMOutputWithPast; plain modules return the logits directly
+        return getattr(outputs, "logits", outputs)
+
+QUANTIZATIONS = ("int4", "int8", "none")
+
+def export_llama(output_path: str = "ruth_llama_1b_mps.pte", quantization: str = "int4"):
+    """
+    Exports RuthLlamaEdge to an ExecuTorch program.
+    
+    Args:
+        output_path: Destination .pte file.
+        quantization: "int4" (group_size=128, the default; fits the 800MB budget), "int8"
+            (per-channel weight-only, opt-in: MPS has native int8 matmuls but emulates int4 via
+            unpack + fp16, at ~1 byte/param the 1B model does not fit the budget) or "none".
+    """
     logger.info("Starting Llama-1B Export...")
     
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization: {quantization}")
+    
     # 1. Load Model
     model_name = "meta-llama/Llama-3.2-1B-Instruct"
     if AutoModelForCausalLM:
@@ -135,8 +220,12 @@ def export_llama(output_path: str = "ruth_llama_1b_mps.pte"):
         # Mocking the interface
         base_model.config = config
 
-    # 2. Quantization (Int4)
-    if quantize_:
+    # 2. Quantization
+    if quantize_ and quantization == "int8":
+        logger.info("Applying Int8 Quantization...")
+        # Opt-in only: ~1 byte/param puts the 1B model over the 800MB budget (checked below)
+        quantize_(base_model, int8_weight_only())
+    elif quantize_ and quantization == "int4":
         logger.info("Applying Int4 Quantization...")
         # group_size=128 is standard for good accuracy/size trade-off
         quantize_(base_model, int4_weight_only(group_size=128))
@@ -148,10 +237,11 @@ def export_llama(output_path: str = "ruth_llama_1b_mps.pte"):
     ruth_model.eval()
 
     # 4. Prepare Dummy Inputs
-    vocab_size = getattr(base_model.config, 'vocab_size', 32000)
+    # Tracing only needs shapes and dtypes: fixed token ids keep exported graphs
+    # reproducible across runs instead of seeding them from the global RNG
     seq_len = 128
-    input_ids = torch.randint(0, vocab_size, (1, seq_len), dtype=torch.long)
-    labels = torch.randint(0, vocab_size, (1, seq_len), dtype=torch.long)
+    input_ids = torch.zeros((1, seq_len), dtype=torch.long)
+    labels = torch.zeros((1, seq_len), dtype=torch.long)
     seed = torch.tensor([42], dtype=torch.long)
     epsilon = 0.1
 
@@ -201,4 +291,10 @@ def export_llama(output_path: str = "ruth_llama_1b_mps.pte"):
         logger.info(f"Created dummy {output_path}")
 
 if __name__ == "__main__":
-    export_llama()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", type=str, default="ruth_llama_1b_mps.pte", help="Destination .pte file")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default="int4",
+                        help="Weight quantization; int8 is opt-in (over the 800MB budget for the 1B model)")
+    args = parser.parse_args()
+    
+    export_llama(args.output, args.quantization)
@@ -2,20 +2,34 @@ import argparse
 import redis
 import os
 
-def update_redis(round_id, model_url):
+def update_redis_many(model_urls):
+    """
+    Sets ruth:round:{round_id}:model_url for every (round_id, model_url) pair.
+    All SETs go in one MULTI/EXEC pipeline: one round trip, applied atomically.
+    """
     redis_url = os.environ.get("REDIS_URL", "redis://localhost")
     redis_password = os.environ.get("REDIS_PASSWORD", None)
     
     r = redis.from_url(redis_url, password=redis_password)
     
-    key = f"ruth:round:{round_id}:model_url"
-    r.set(key, model_url)
-    print(f"Updated {key} -> {model_url}")
+    with r.pipeline(transaction=True) as pipe:
+        for round_id, model_url in model_urls:
+            pipe.set(f"ruth:round:{round_id}:model_url", model_url)
+        pipe.execute()
+    
+    for round_id, model_url in model_urls:
+        print(f"Updated ruth:round:{round_id}:model_url -> {model_url}")
+
+def update_redis(round_id, model_url):
+    update_redis_many([(round_id, model_url)])
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--round", type=int, required=True, help="Round ID")
-    parser.add_argument("--url", type=str, required=True, help="S3 URL of the model")
+    parser.add_argument("--round", type=int, action="append", required=True, help="Round ID (repeatable)")
+    parser.add_argument("--url", type=str, action="append", required=True, help="S3 URL of the model (one per --round)")
     args = parser.parse_args()
     
-    update_redis(args.round, args.url)
+    if len(args.round) != len(args.url):
+        parser.error("--round and --url must be given the same number of times")
+    
+    update_redis_many(list(zip(args.round, args.url)))
@@ -1,3 +1,4 @@
+import numpy as np
 import torch
 import pytest
 from ruth.server.aggregator import RobustAggregator
@@ -24,6 +25,51 @@ def test_reconstruction():
     assert gradients.shape == (1, 10)
     assert torch.allclose(gradients[0], expected_g)
 
+def test_reconstruction_columns():
+    shape = (10,)
+    prng = Xoshiro256StarStar(seeds=[1, 2, 3])
+    aggregator = RobustAggregator(prng=prng, shape=shape)
+    
+    payloads = [{'seed_id': 1, 'scalar': 2.0}, {'seed_id': 3, 'scalar': -0.5}]
+    seed_ids = np.array([1, 3], dtype=np.uint64)
+    scalars = np.array([2.0, -0.5], dtype=np.float32)
+    
+    gradients = aggregator.reconstruct_columns(seed_ids, scalars)
+    
+    assert gradients.shape == (2, 10)
+    assert torch.allclose(gradients, aggregator.reconstruct(payloads))
+
+@pytest.mark.parametrize("backend", ["numpy", "torch"])
+def test_reconstruction_in_place(backend):
+    shape = (64,)
+    prng = Xoshiro256StarStar(seeds=[1, 2], backend=backend)
+    aggregator = RobustAggregator(prng=prng, shape=shape)
+    
+    gradients = aggregator.reconstruct_columns([1, 2], [0.5, -3.0])
+    
+    # Scaling in place must not alias the PRNG's output across calls
+    assert torch.equal(gradients[0], 0.5 * prng.generate_noise_vector(1, shape))
+    assert torch.equal(gradients[1], -3.0 * prng.generate_noise_vector(2, shape))
+    assert torch.equal(aggregator.reconstruct_columns([1, 2], [0.5, -3.0]), gradients)
+
+def test_reconstruction_prestacked_noise():
+    shape = (8, 4)
+    prng = Xoshiro256StarStar(seeds=[1, 2, 3])
+    aggregator = RobustAggregator(prng=prng, shape=shape)
+    payloads = [{'seed_id': 3, 'scalar': 2.0}, {'seed_id': 1, 'scalar': -0.5}]
+    
+    noise = prng.generate_noise_matrix([3, 1], shape)
+    original = noise.clone()
+    
+    gradients = aggregator.reconstruct(payloads, noise=noise)
+    
+    assert torch.equal(gradients, aggregator.reconstruct(payloads))
+    # Caller-owned noise is left untouched
+    assert torch.equal(noise, original)
+    
+    with pytest.raises(ValueError):
+        aggregator.reconstruct(payloads, noise=noise[:1])
+
 def test_trimmed_mean_aggregation():
     shape = (5,)
     prng = Xoshiro256StarStar(seeds=[1]) # Dummy
@@ -47,6 +93,27 @@ def test_trimmed_mean_aggregation():
     # Expectation: Outliers removed. Mean of 8 ones is 1.0.
     assert torch.allclose(aggregated, torch.ones(5))
 
+def test_trimmed_mean_unordered_outliers():
+    shape = (5,)
+    prng = Xoshiro256StarStar(seeds=[1]) # Dummy
+    aggregator = RobustAggregator(prng=prng, shape=shape, trim_ratio=0.2)
+    
+    # 10 clients, k=2: outliers (including inf) land on different rows per coordinate
+    gradients = torch.ones(10, 5)
+    gradients[3, 0] = float('inf')
+    gradients[7, 0] = -float('inf')
+    gradients[0, 1] = 1e30
+    gradients[9, 1] = -1e30
+    gradients[:, 2] = torch.arange(10, dtype=torch.float32)[torch.randperm(10, generator=torch.Generator().manual_seed(0))]
+    
+    aggregated = aggregator.aggregate(gradients)
+    
+    # Reference: full sort and slice
+    expected = gradients.sort(dim=0).values[2:-2].mean(dim=0)
+    assert torch.isfinite(aggregated).all()
+    assert torch.allclose(aggregated, expected)
+    assert aggregated[2] == 4.5
+
 def test_aggregation_no_trim():
     shape = (5,)
     prng = Xoshiro256StarStar(seeds=[1])
@@ -66,8 +133,50 @@ def test_aggregation_no_trim():
     # Mean should be 3.0
     assert torch.allclose(aggregated, torch.full((5,), 3.0))
 
+@pytest.mark.parametrize("backend", ["numpy", "torch"])
+def test_streaming_aggregation(backend):
+    shape = (1000,)
+    prng = Xoshiro256StarStar(seeds=[1], backend=backend)
+    aggregator = RobustAggregator(prng=prng, shape=shape, trim_ratio=0.2)
+    
+    seed_ids = [11, 12, 13, 14, 15]
+    scalars = [0.5, -1.0, 2.0, 0.1, 100.0]
+    
+    # Block size that does not divide num_params, to cover the ragged last block
+    streamed = aggregator.aggregate_stream(seed_ids, scalars, block_size=96)
+    expected = aggregator.aggregate(aggregator.reconstruct_columns(seed_ids, scalars))
+    
+    assert streamed.shape == (1000,)
+    assert torch.allclose(streamed, expected)
+
+def test_bf16_reconstruction():
+    shape = (100,)
+    prng = Xoshiro256StarStar(seeds=[1, 2, 3])
+    payloads = [{'seed_id': s, 'scalar': 0.5 * s} for s in [1, 2, 3, 1, 2]]
+    
+    fp32 = RobustAggregator(prng=prng, shape=shape, trim_ratio=0.2)
+    bf16 = RobustAggregator(prng=prng, shape=shape, trim_ratio=0.2, dtype=torch.bfloat16)
+    
+    gradients = bf16.reconstruct(payloads)
+    assert gradients.dtype == torch.bfloat16
+    assert gradients.shape == (5, 100)
+    
+    # Aggregate is accumulated and returned in float32, within bf16 precision of the fp32 path
+    aggregated = bf16.aggregate(gradients)
+    assert aggregated.dtype == torch.float32
+    expected = fp32.aggregate(fp32.reconstruct(payloads))
+    assert torch.allclose(aggregated, expected, rtol=1e-2, atol=1e-2)
+
 if __name__ == "__main__":
     test_reconstruction()
+    test_reconstruction_columns()
+    test_reconstruction_in_place("numpy")
+    test_reconstruction_in_place("torch")
+    test_reconstruction_prestacked_noise()
     test_trimmed_mean_aggregation()
+    test_trimmed_mean_unordered_outliers()
     test_aggregation_no_trim()
+    test_streaming_aggregation("numpy")
+    test_streaming_aggregation("torch")
+    test_bf16_reconstruction()
     print("All RobustAggregator tests passed!")
@@ -1,7 +1,11 @@
 import pytest
 import asyncio
 from unittest.mock import MagicMock, AsyncMock, patch
-from ruth.server.async_aggregator import AsyncAggregator
+import torch
+from ruth.core.prng import Xoshiro256StarStar
+from ruth.server.aggregator import RobustAggregator
+from ruth.server.async_aggregator import AsyncAggregator, _to_columns
+import ruth.server.async_aggregator as async_aggregator
 
 # Mock ClientUpdate Protobuf Object
 class MockClientUpdate:
@@ -17,6 +21,13 @@ class MockClientUpdate:
     def SerializeToString(self):
         return f"{self.device_id}:{self.scalar}".encode('utf-8')
 
+@pytest.fixture(autouse=True)
+def clear_pools():
+    # Pools are shared process-wide; don't leak one test's mock pool into the next
+    async_aggregator._POOLS.clear()
+    yield
+    async_aggregator._POOLS.clear()
+
 @pytest.mark.asyncio
 async def test_submit_update():
     # Mock Redis
@@ -44,6 +55,7 @@ async def test_submit_update():
         # Verify Redis calls
         mock_pipeline.lpush.assert_called_once()
         mock_pipeline.incr.assert_called_once()
+        mock_pipeline.zincrby.assert_called_once()
         mock_pipeline.execute.assert_called_once()
         
         # Verify arguments
@@ -53,6 +65,9 @@ async def test_submit_update():
         
         args, _ = mock_pipeline.incr.call_args
         assert args[0] == "ruth:round:1:count"
+        
+        args, _ = mock_pipeline.zincrby.call_args
+        assert args == ("ruth:rounds_ready", 1, "1")
 
 @pytest.mark.asyncio
 async def test_worker_aggregation_trigger():
@@ -67,21 +82,17 @@ async def test_worker_aggregation_trigger():
     mock_pool.disconnect = AsyncMock()
     
     # Setup mock data for worker loop
-    # 1. scan() returns (cursor, keys)
-    # First call returns (b'0', [key]) to simulate finding one key and finishing
-    mock_redis.scan.return_value = (b'0', [b"ruth:round:1:count"])
-    
-    # 2. get() returns count >= threshold
-    mock_redis.get.return_value = b"10" # Threshold is 10
+    # 1. zrangebyscore() returns (round_id, count) pairs at or above threshold
+    mock_redis.zrangebyscore.return_value = [(b"1", 10.0)] # Threshold is 10
     
-    # 3. lrange() returns list of updates
+    # 2. The drain transaction returns [popped updates, count, score, removed]
     # We need to return serialized data that ParseFromString can handle
     # Since we use a dummy ruth_pb2 in the source if import fails, we should match that.
     # But wait, the source code imports ruth_pb2 or defines a dummy class.
     # The dummy class has ParseFromString.
     # We should return bytes that won't crash ParseFromString.
     # The dummy ParseFromString does nothing (pass).
-    mock_redis.lrange.return_value = [b"update1", b"update2"]
+    mock_pipeline.execute.return_value = [[b"update1", b"update2"], 0, 0.0, 1]
     
     with patch('ruth.server.async_aggregator.redis.ConnectionPool.from_url', return_value=mock_pool), \
          patch('ruth.server.async_aggregator.redis.Redis', return_value=mock_redis):
@@ -98,19 +109,129 @@ async def test_worker_aggregation_trigger():
         await aggregator.stop_worker()
         
         # Verify Aggregation Triggered
-        # Should have called lrange to get updates
-        mock_redis.lrange.assert_called()
-        args, _ = mock_redis.lrange.call_args
-        assert args[0] == "ruth:round:1:updates"
+        # Should have atomically popped exactly the counted updates (via pipeline)
+        mock_pipeline.rpop.assert_any_call("ruth:round:1:updates", 10)
+        mock_pipeline.eval.assert_any_call(async_aggregator.DRAIN_COUNT_SCRIPT, 1, "ruth:round:1:count", 10)
+        mock_pipeline.zincrby.assert_any_call("ruth:rounds_ready", -10, "1")
+        mock_pipeline.zremrangebyscore.assert_any_call("ruth:rounds_ready", "-inf", 0)
+        
+        # Only ready rounds are queried
+        args, _ = mock_redis.zrangebyscore.call_args
+        assert args == ("ruth:rounds_ready", 10, "+inf")
         
-        # Should have called delete to cleanup (via pipeline)
-        mock_pipeline.delete.assert_any_call("ruth:round:1:updates")
-        mock_pipeline.delete.assert_any_call("ruth:round:1:count")
+        # The shared pool outlives the aggregator
+        mock_pool.disconnect.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_trigger_aggregation_columns():
+    mock_redis = AsyncMock()
+    mock_pipeline = AsyncMock()
+    mock_redis.pipeline = MagicMock()
+    mock_redis.pipeline.return_value.__aenter__.return_value = mock_pipeline
+    mock_pipeline.execute.return_value = [[b"u0", b"u1", b"u2"], 0, 0.0, 1]
+    
+    updates = [MockClientUpdate(round_id=1, scalar=s) for s in (0.5, -1.0, 2.0)]
+    for seed_id, update in enumerate(updates):
+        update.seed_id = seed_id
+        
+    shape = (8,)
+    robust = RobustAggregator(prng=Xoshiro256StarStar(seeds=list(range(10))), shape=shape, trim_ratio=0.0)
+    
+    with patch('ruth.server.async_aggregator.redis.ConnectionPool.from_url'), \
+         patch('ruth.server.async_aggregator.redis.Redis', return_value=mock_redis), \
+         patch('ruth.server.async_aggregator._parse_batch', return_value=updates):
+        
+        aggregator = AsyncAggregator("redis://localhost", k_threshold=3, aggregator=robust)
+        global_grad = await aggregator._trigger_aggregation(1, 3)
+        
+        # Same result as aggregating the updates' columns directly
+        expected = robust.aggregate(robust.reconstruct_columns([0, 1, 2], [0.5, -1.0, 2.0]))
+        assert global_grad.shape == shape
+        assert torch.allclose(global_grad, expected)
+        
+        # Without an aggregator the round is drained but not aggregated
+        aggregator.aggregator = None
+        assert await aggregator._trigger_aggregation(1, 3) is None
+
+@pytest.mark.asyncio
+async def test_drain_deletes_count_key():
+    # Real Redis semantics (including the Lua drain script) via fakeredis
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    fake = fakeredis.FakeAsyncRedis()
+    
+    with patch('ruth.server.async_aggregator.redis.ConnectionPool.from_url'), \
+         patch('ruth.server.async_aggregator.redis.Redis', return_value=fake):
+        
+        aggregator = AsyncAggregator("redis://localhost", k_threshold=2)
+        for k in range(3):
+            await aggregator.submit_update(MockClientUpdate(round_id=1, device_id=f"device{k}"))
+            
+        # Partial drain keeps the remainder counted
+        await aggregator._trigger_aggregation(1, 2)
+        assert await fake.get("ruth:round:1:count") == b"1"
+        assert await fake.llen("ruth:round:1:updates") == 1
+        
+        # Fully drained rounds leave no keys behind
+        await aggregator._trigger_aggregation(1, 1)
+        assert not await fake.exists("ruth:round:1:count")
+        assert not await fake.exists("ruth:round:1:updates")
+        assert await fake.zscore("ruth:rounds_ready", "1") is None
+        
+        await aggregator.stop_worker()
+
+@pytest.mark.asyncio
+async def test_shared_connection_pool():
+    mock_pool = MagicMock()
+    mock_pool.disconnect = AsyncMock()
+    
+    with patch('ruth.server.async_aggregator.redis.ConnectionPool.from_url', return_value=mock_pool) as mock_from_url, \
+         patch('ruth.server.async_aggregator.redis.Redis'):
+        
+        first = AsyncAggregator("redis://localhost", k_threshold=10)
+        second = AsyncAggregator("redis://localhost", k_threshold=5)
+        
+        # One pool per URL, reused by every aggregator
+        assert first.pool is second.pool
+        mock_from_url.assert_called_once_with("redis://localhost", password=None)
+        
+        AsyncAggregator("redis://other", k_threshold=10)
+        assert mock_from_url.call_count == 2
+        
+        # One parse pool for the process, not one per aggregator
+        parse_pool = async_aggregator._get_parse_pool()
+        assert async_aggregator._get_parse_pool() is parse_pool
+        
+        await async_aggregator.close_pools()
+        assert mock_pool.disconnect.await_count == 2
+        assert not async_aggregator._POOLS
+        assert async_aggregator._PARSE_POOL is None
+        with pytest.raises(RuntimeError):
+            parse_pool.submit(int)
+
+def test_to_columns():
+    updates = [MockClientUpdate(round_id=1, scalar=0.5), MockClientUpdate(round_id=2, scalar=-1.0)]
+    updates[0].signature = bytes(range(64))
+    
+    columns = _to_columns(updates)
+    
+    assert columns["seed_ids"].tolist() == [123, 123]
+    assert columns["round_ids"].tolist() == [1, 2]
+    assert columns["scalars"].tolist() == [0.5, -1.0]
+    assert columns["signatures"].shape == (2, 64)
+    assert columns["signatures"][0].tobytes() == bytes(range(64))
 
 if __name__ == "__main__":
     # Manually run async tests if pytest-asyncio not working via command line
+    # (clearing the shared pools between tests, as the clear_pools fixture does)
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     loop.run_until_complete(test_submit_update())
+    async_aggregator._POOLS.clear()
     loop.run_until_complete(test_worker_aggregation_trigger())
+    async_aggregator._POOLS.clear()
+    loop.run_until_complete(test_trigger_aggregation_columns())
+    async_aggregator._POOLS.clear()
+    loop.run_until_complete(test_shared_connection_pool())
+    test_to_columns()
     print("All Async Aggregator tests passed!")
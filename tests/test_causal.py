@@ -1,6 +1,7 @@
 import numpy as np
 import pytest
-from ruth.causal.discovery import preprocess_sensors, run_discovery, validate_event
+from ruth.causal.discovery import preprocess_sensors, run_discovery, validate_event, _summary_graph
+import ruth.causal.discovery as discovery
 
 def test_preprocess_sensors():
     # Setup: 10 seconds of data at 50Hz
@@ -55,6 +56,74 @@ def test_run_discovery():
     # Check binary matrix
     assert np.all(np.isin(graph, [0, 1]))
 
+@pytest.mark.skipif(not discovery.TIGRAMITE_AVAILABLE, reason="tigramite not installed")
+def test_run_discovery_cache(monkeypatch):
+    discovery.clear_discovery_cache()
+    data = np.random.default_rng(seed=2).standard_normal((100, 3))
+    
+    first = run_discovery(data)
+    
+    # A cache hit must not touch PCMCI at all
+    def fail(*args, **kwargs):
+        raise AssertionError("PCMCI re-run on cached input")
+    monkeypatch.setattr(discovery.PCMCI, "run_pcmci", fail)
+    
+    data_copy = data.copy()
+    second = run_discovery(data_copy)
+    assert np.array_equal(first["graph"], second["graph"])
+    assert second["features"] is data_copy
+    
+    # Modifying a returned result must not leak into later cache hits
+    expected_graph = first["graph"].copy()
+    expected_p = first["raw_results"]["p_matrix"].copy()
+    second["graph"][:] = 7
+    second["raw_results"]["p_matrix"][:] = 7.0
+    first["graph"][:] = 7
+    third = run_discovery(data)
+    assert np.array_equal(third["graph"], expected_graph)
+    assert np.array_equal(third["raw_results"]["p_matrix"], expected_p)
+    
+    # Different parameters are a different entry
+    with pytest.raises(AssertionError):
+        run_discovery(data, tau_max=2)
+    discovery.clear_discovery_cache()
+
+def test_summary_graph():
+    n_features = 4
+    tau_max = 3
+    alpha = 0.01
+    rng = np.random.default_rng(seed=0)
+    p_matrix = rng.uniform(0.0, 0.05, size=(n_features, n_features, tau_max + 1))
+    
+    # Reference: explicit loop over (effect, cause, lag)
+    expected = np.zeros((n_features, n_features), dtype=int)
+    for j in range(n_features):
+        for i in range(n_features):
+            for tau in range(1, tau_max + 1):
+                if p_matrix[i, j, tau] < alpha:
+                    expected[i, j] = 1
+                    break
+    
+    graph = _summary_graph(p_matrix, tau_max, alpha)
+    assert np.array_equal(graph, expected)
+    
+    # Lag 0 must be ignored
+    p_matrix = np.ones((n_features, n_features, tau_max + 1))
+    p_matrix[:, :, 0] = 0.0
+    assert not _summary_graph(p_matrix, tau_max, alpha).any()
+
+@pytest.mark.skipif(not discovery.NUMBA_AVAILABLE, reason="numba not installed")
+def test_summary_graph_numba():
+    n_features = discovery.NUMBA_MIN_FEATURES
+    tau_max = 3
+    alpha = 0.01
+    rng = np.random.default_rng(seed=1)
+    p_matrix = rng.uniform(0.0, 0.5, size=(n_features, n_features, tau_max + 1))
+    
+    expected = (p_matrix[:, :, 1:tau_max + 1] < alpha).any(axis=2).astype(int)
+    graph = _summary_graph(p_matrix, tau_max, alpha)
+    assert np.array_equal(graph, expected)
+
 def test_validate_event():
     n_features = 5
     graph = np.zeros((n_features, n_features))
@@ -74,5 +143,11 @@ def test_validate_event():
 if __name__ == "__main__":
     test_preprocess_sensors()
     test_run_discovery()
+    if discovery.TIGRAMITE_AVAILABLE:
+        with pytest.MonkeyPatch.context() as monkeypatch:
+            test_run_discovery_cache(monkeypatch)
+    test_summary_graph()
+    if discovery.NUMBA_AVAILABLE:
+        test_summary_graph_numba()
     test_validate_event()
     print("All Causal tests passed!")
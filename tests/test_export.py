@@ -1,4 +1,5 @@
 import torch
+import torch.nn.functional as F
 import pytest
 from ruth.core.export import RuthEdge
 
@@ -34,7 +35,55 @@ def test_ruth_edge_perturb():
     # Check that original weights are NOT mutated
     assert torch.allclose(model.lora_a.weight, orig_wa)
 
+@pytest.mark.parametrize("batch_size", [1, 8])
+def test_ruth_edge_perturb_pair(batch_size):
+    model = RuthEdge()
+    x = torch.randn(batch_size, 10)
+    y = torch.randint(0, 2, (batch_size,), dtype=torch.long)
+    
+    total_params = sum(p.numel() for p in model.lora_a.parameters()) + \
+                   sum(p.numel() for p in model.lora_b.parameters())
+    v_flat = torch.randn(total_params)
+    epsilon = 0.1
+    
+    orig_wa = model.lora_a.weight.clone()
+    
+    loss_plus, loss_minus = model.forward_perturb_pair(x, y, v_flat, epsilon)
+    
+    # Must match two independent forward_perturb calls
+    assert torch.allclose(loss_plus, model.forward_perturb(x, y, v_flat, epsilon))
+    assert torch.allclose(loss_minus, model.forward_perturb(x, y, v_flat, -epsilon))
+    
+    # Original weights are NOT mutated
+    assert torch.allclose(model.lora_a.weight, orig_wa)
+
+class RenamedEdge(RuthEdge):
+    """RuthEdge with differently named adapters and its own forward()."""
+    def __init__(self):
+        super().__init__()
+        self.down, self.up = self.lora_a, self.lora_b
+        del self.lora_a, self.lora_b
+        self._trainable = self._perturbation_plan()
+        
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.head(F.relu(self.base_layer(x) + self.up(self.down(x))))
+
+def test_ruth_edge_perturb_pair_renamed():
+    model = RenamedEdge()
+    assert [name for name, *_ in model._trainable] == ["down.weight", "up.weight"]
+    x = torch.randn(4, 10)
+    y = torch.randint(0, 2, (4,), dtype=torch.long)
+    v_flat = torch.randn(sum(numel for *_, numel in model._trainable))
+    
+    # The pair path follows the module's own parameters and forward(), not RuthEdge's names
+    loss_plus, loss_minus = model.forward_perturb_pair(x, y, v_flat, 0.1)
+    assert torch.allclose(loss_plus, model.forward_perturb(x, y, v_flat, 0.1))
+    assert torch.allclose(loss_minus, model.forward_perturb(x, y, v_flat, -0.1))
+
 if __name__ == "__main__":
     test_ruth_edge_forward()
     test_ruth_edge_perturb()
+    test_ruth_edge_perturb_pair(1)
+    test_ruth_edge_perturb_pair(8)
+    test_ruth_edge_perturb_pair_renamed()
     print("All tests passed!")
@@ -0,0 +1,34 @@
+import importlib.util
+import os
+import torch
+import torch.nn as nn
+
+# scripts/ is not a package: load the export script by path
+_SCRIPT = os.path.join(os.path.dirname(__file__), "..", "scripts", "ios_export_llama.py")
+_spec = importlib.util.spec_from_file_location("ios_export_llama", _SCRIPT)
+ios_export_llama = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(ios_export_llama)
+
+def test_forward_perturb_batch_fp16():
+    torch.manual_seed(0)
+    vocab_size, hidden_dim = 50, 16
+    # fp16 weights, like the model export_llama loads
+    model = nn.Sequential(nn.Embedding(vocab_size, hidden_dim), nn.Linear(hidden_dim, vocab_size)).half()
+    edge = ios_export_llama.RuthLlamaEdge(model)
+    
+    input_ids = torch.randint(0, vocab_size, (1, 8))
+    labels = torch.randint(0, vocab_size, (1, 8))
+    seeds = torch.tensor([3, 17, 42])
+    # Not representable in fp16: rounding epsilon to the weight dtype would show up here
+    epsilons = torch.tensor([0.1, 0.0123, 0.3], dtype=torch.float64)
+    
+    losses = edge.forward_perturb_batch(input_ids, labels, seeds, epsilons)
+    
+    assert losses.shape == (3,)
+    for k in range(3):
+        expected = edge.forward_perturb(input_ids, labels, int(seeds[k]), float(epsilons[k]))
+        assert torch.allclose(losses[k], expected, atol=1e-5), (k, losses[k].item(), expected.item())
+
+if __name__ == "__main__":
+    test_forward_perturb_batch_fp16()
+    print("All tests passed!")
@@ -2,6 +2,10 @@ import torch
 import numpy as np
 import pytest
 from ruth.core.prng import Xoshiro256StarStar
+import ruth.core.prng as prng_module
+
+requires_numba = pytest.mark.skipif(not prng_module.NUMBA_AVAILABLE, reason="numba not installed")
+BACKENDS = ["numpy", "torch", pytest.param("xoshiro", marks=requires_numba)]
 
 def test_prng_reproducibility():
     prng = Xoshiro256StarStar(seeds=[42, 123])
@@ -25,6 +29,32 @@ def test_prng_next_seed():
     assert prng.next_seed() == 20
     assert prng.next_seed() == 30
     assert prng.next_seed() == 10 # Cycle
+    
+    # Random access into the same schedule, without moving it
+    assert [prng.seed_at(i) for i in range(5)] == [10, 20, 30, 10, 20]
+    assert prng.next_seed() == 20
+    
+    with pytest.raises(ValueError):
+        Xoshiro256StarStar(seeds=[]).seed_at(0)
+
+def test_prng_cursors():
+    seeds = [10, 20, 30]
+    prng = Xoshiro256StarStar(seeds=seeds)
+    prng.next_seed()
+    
+    cursor = prng.get_cursor()
+    assert cursor == 1
+    seed, cursor = prng.advance_from(cursor)
+    assert (seed, cursor) == (20, 2)
+    assert prng.advance_from(cursor) == (30, 3)
+    assert prng.advance_from(3) == (10, 4) # Cycle
+    
+    # Cursors never move the shared position
+    assert prng.get_cursor() == 1
+    assert prng.next_seed() == 20
+    
+    with pytest.raises(ValueError):
+        Xoshiro256StarStar(seeds=[]).advance_from(0)
 
 def test_prng_shape():
     prng = Xoshiro256StarStar(seeds=[1])
@@ -45,9 +75,139 @@ def test_prng_distribution():
     assert abs(mean) < 0.01, f"Mean {mean} should be close to 0"
     assert abs(std - 1.0) < 0.01, f"Std {std} should be close to 1"
 
+def test_prng_noise_matrix():
+    prng = Xoshiro256StarStar(seeds=[1, 2, 3])
+    shape = (5, 4)
+    seed_ids = [3, 1, 3]
+    
+    matrix = prng.generate_noise_matrix(seed_ids, shape)
+    
+    assert matrix.shape == (3, 20)
+    for k, seed_id in enumerate(seed_ids):
+        assert torch.equal(matrix[k], prng.generate_noise_vector(seed_id, shape))
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_prng_noise_blocks(backend):
+    prng = Xoshiro256StarStar(seeds=[1], backend=backend)
+    shape = (1000,)
+    seed_ids = [1, 2, 3]
+    
+    blocks = [(start, block.clone()) for start, block in prng.generate_noise_blocks(seed_ids, shape, block_size=96)]
+    streamed = torch.cat([block for _, block in blocks], dim=1)
+    
+    assert [start for start, _ in blocks] == list(range(0, 1000, 96))
+    assert torch.equal(streamed, prng.generate_noise_matrix(seed_ids, shape))
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_prng_out_buffer(backend):
+    prng = Xoshiro256StarStar(seeds=[1, 2], backend=backend)
+    shape = (5, 4)
+    buf = torch.empty(20)
+    
+    v = prng.generate_noise_vector(seed_id=1, shape=shape, out=buf)
+    assert v.data_ptr() == buf.data_ptr(), "Noise must be written into the provided buffer"
+    assert torch.equal(v, prng.generate_noise_vector(seed_id=1, shape=shape))
+    
+    # Reusing the buffer overwrites it with the new seed's noise
+    prng.generate_noise_vector(seed_id=2, shape=shape, out=buf)
+    assert torch.equal(buf, prng.generate_noise_vector(seed_id=2, shape=shape))
+    
+    with pytest.raises(ValueError):
+        prng.generate_noise_vector(seed_id=1, shape=shape, out=torch.empty(10))
+
+def test_prng_torch_backend():
+    prng = Xoshiro256StarStar(seeds=[1, 2], backend="torch")
+    shape = (5, 4)
+    
+    v1 = prng.generate_noise_vector(seed_id=1, shape=shape)
+    v2 = prng.generate_noise_vector(seed_id=1, shape=shape)
+    assert v1.shape == (20,)
+    assert v1.dtype == torch.float32
+    assert torch.equal(v1, v2), "Vectors with same seed must be identical"
+    
+    matrix = prng.generate_noise_matrix([1, 2], shape)
+    assert torch.equal(matrix[0], v1)
+    assert torch.equal(matrix[1], prng.generate_noise_vector(seed_id=2, shape=shape))
+    
+    with pytest.raises(ValueError):
+        Xoshiro256StarStar(seeds=[1], backend="unknown")
+
+@requires_numba
+def test_prng_xoshiro_backend():
+    prng = Xoshiro256StarStar(seeds=[42], backend="xoshiro")
+    
+    # Reference output of RuthTrainer::generate_perturbation(42, buffer[11]) (ruth/core/cpp/fwd_llm.cpp)
+    expected = np.array([
+        -1.61322379, 1.53448737, 0.781692028, -0.400193483, 0.0158712938, -0.127309933,
+        0.47721681, -0.656759322, -0.639451087, -0.369272858, -0.220993787
+    ], dtype=np.float32)
+    v = prng.generate_noise_vector(seed_id=42, shape=(11,))
+    assert v.dtype == torch.float32
+    np.testing.assert_array_equal(v.numpy(), expected)
+    
+    matrix = prng.generate_noise_matrix([42, 7], (11,))
+    assert torch.equal(matrix[0], v)
+    assert torch.equal(matrix[1], prng.generate_noise_vector(seed_id=7, shape=(11,)))
+    
+    # Odd block sizes fall back to slicing the full matrix
+    blocks = [block.clone() for _, block in prng.generate_noise_blocks([42, 7], (11,), block_size=3)]
+    assert torch.equal(torch.cat(blocks, dim=1), matrix)
+
+@requires_numba
+def test_prng_xoshiro_split_fill():
+    # The split (serial draws, parallel Box-Muller) kernel reproduces the single-pass stream,
+    # including across raw-buffer blocks and with an odd tail
+    block = 2 * prng_module._XOSHIRO_SPLIT_PAIRS
+    for n in [1, 11, block, 2 * block + 1]:
+        split = np.empty(n, dtype=np.float32)
+        prng_module._xoshiro_fill_split(Xoshiro256StarStar._xoshiro_states([9])[0], split)
+        single = np.empty((1, n), dtype=np.float32)
+        prng_module._xoshiro_fill_batch(Xoshiro256StarStar._xoshiro_states([9]), single)
+        np.testing.assert_array_equal(split, single[0])
+
+def test_prng_noise_cache():
+    shape = (5, 4)
+    reference = Xoshiro256StarStar(seeds=[1, 2, 3])
+    prng = Xoshiro256StarStar(seeds=[1, 2, 3], cache_size=2)
+    
+    v1 = prng.generate_noise_vector(seed_id=1, shape=shape)
+    assert torch.equal(v1, reference.generate_noise_vector(seed_id=1, shape=shape))
+    assert prng.generate_noise_vector(seed_id=1, shape=shape) is v1, "Cache hit must not regenerate"
+    
+    # Matrix rows come from the cache but the matrix itself is a fresh copy
+    matrix = prng.generate_noise_matrix([1, 2, 1], shape)
+    assert torch.equal(matrix, reference.generate_noise_matrix([1, 2, 1], shape))
+    matrix.mul_(0.0)
+    assert torch.equal(prng.generate_noise_vector(seed_id=1, shape=shape), v1)
+    assert not torch.equal(v1, torch.zeros_like(v1))
+    
+    # out= gets a copy
+    buf = torch.empty(20)
+    prng.generate_noise_vector(seed_id=1, shape=shape, out=buf)
+    assert torch.equal(buf, v1) and buf.data_ptr() != v1.data_ptr()
+    
+    # LRU eviction (capacity 2): seed 2 is the least recently used
+    prng.generate_noise_vector(seed_id=3, shape=shape)
+    assert list(prng._cache) == [(1, shape), (3, shape)]
+    prng.clear_round_cache()
+    assert len(prng._cache) == 0
+
 if __name__ == "__main__":
     test_prng_reproducibility()
     test_prng_next_seed()
+    test_prng_cursors()
     test_prng_shape()
     test_prng_distribution()
+    test_prng_noise_matrix()
+    test_prng_noise_blocks("numpy")
+    test_prng_noise_blocks("torch")
+    test_prng_out_buffer("numpy")
+    test_prng_out_buffer("torch")
+    test_prng_torch_backend()
+    test_prng_noise_cache()
+    if prng_module.NUMBA_AVAILABLE:
+        test_prng_noise_blocks("xoshiro")
+        test_prng_out_buffer("xoshiro")
+        test_prng_xoshiro_backend()
+        test_prng_xoshiro_split_fill()
     print("All PRNG tests passed!")
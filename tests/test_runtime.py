@@ -34,6 +34,28 @@ def test_client_runtime_step():
     # rho_adj = rho - baseline
     # We can verify that baseline is changing
     assert runtime.baseline != 0.0
+    
+    # Explicit schedule index: picks the seed directly and leaves the cycle alone
+    assert runtime.step(batch_x, batch_y, seed_index=4)["seed_id"] == 123
+    assert runtime.step(batch_x, batch_y)["seed_id"] == 999
+
+def test_shared_prng_cursors():
+    seeds = [42, 123, 999]
+    prng = Xoshiro256StarStar(seeds=seeds)
+    batch_x = torch.randn(1, 10)
+    batch_y = torch.tensor([0], dtype=torch.long)
+    
+    first = ClientRuntime(model=RuthEdge(), prng=prng, epsilon_schedule=0.1, cursor=0)
+    second = ClientRuntime(model=RuthEdge(), prng=prng, epsilon_schedule=0.1, cursor=2)
+    
+    assert first.step(batch_x, batch_y)["seed_id"] == 42
+    assert second.step(batch_x, batch_y)["seed_id"] == 999
+    assert second.step(batch_x, batch_y)["seed_id"] == 42 # Cycle
+    assert first.step(batch_x, batch_y)["seed_id"] == 123
+    assert (first.cursor, second.cursor) == (2, 4)
+    
+    # The shared PRNG's own position is untouched
+    assert prng.get_cursor() == 0
 
 def test_clipping():
     model = RuthEdge()
@@ -50,5 +72,6 @@ def test_clipping():
 
 if __name__ == "__main__":
     test_client_runtime_step()
+    test_shared_prng_cursors()
     test_clipping()
     print("All ClientRuntime tests passed!")
@@ -1,5 +1,7 @@
-from ruth.server.schema import SeedSet, ScalarUpload, AggResponse
+from ruth.server.schema import SeedSet, ScalarUpload, AggResponse, to_bf16
+from pydantic import ValidationError
 import pytest
+import torch
 
 def test_seed_set():
     data = {
@@ -23,6 +25,32 @@ def test_scalar_upload():
     model = ScalarUpload(**data)
     assert model.scalar == 0.5
     assert model.attestation_token == "token123"
+    assert model.scalar_dtype == "fp32"
+    
+    # bf16 uploads carry the scalar rounded exactly as torch would round it
+    data.update(scalar=0.1234567, scalar_dtype="bf16")
+    model = ScalarUpload(**data)
+    expected = float(torch.tensor(0.1234567).to(torch.bfloat16).to(torch.float32))
+    assert model.scalar == expected
+    assert model.scalar != 0.1234567
+    
+    with pytest.raises(ValueError):
+        ScalarUpload(**{**data, "scalar_dtype": "int3"})
+    
+    # Finite scalars past the bf16 range are rejected as invalid input, not a raw OverflowError
+    with pytest.raises(ValidationError):
+        ScalarUpload(**{**data, "scalar": 1e39})
+
+def test_to_bf16_matches_torch():
+    values = torch.randn(1000, dtype=torch.float32) * 10
+    values = torch.cat([values, torch.tensor([0.0, -0.0, 5.0, -5.0, 1e-40, float("inf")])])
+    expected = values.to(torch.bfloat16).to(torch.float32).tolist()
+    assert [to_bf16(v) for v in values.tolist()] == expected
+    
+    # Beyond float32 range: saturate like the float64 -> float32 -> bfloat16 path
+    big = torch.tensor([1e39, -1e39, 3.4e38], dtype=torch.float64)
+    expected = big.to(torch.float32).to(torch.bfloat16).to(torch.float32).tolist()
+    assert [to_bf16(v) for v in big.tolist()] == expected
 
 def test_agg_response():
     data = {
@@ -35,5 +63,6 @@ def test_agg_response():
 if __name__ == "__main__":
     test_seed_set()
     test_scalar_upload()
+    test_to_bf16_matches_torch()
     test_agg_response()
     print("All Schema tests passed!")
@@ -1,3 +1,5 @@
+import asyncio
+import numpy as np
 import pytest
 from ruth.client.security import SecurityManager
 from ruth.server.verifier import Gatekeeper
@@ -11,87 +13,266 @@ class MockClientUpdate:
         self.signature = signature
         self.attestation_token = attestation_token
 
-from unittest.mock import MagicMock, patch
+from contextlib import contextmanager
+from unittest.mock import patch
+import base64
+import hashlib
 import json
+import struct
 
-def test_security_flow():
-    # Mock Response for Attestation
-    mock_response = MagicMock()
-    mock_response.status = 200
-    mock_response.read.return_value = json.dumps({
+def _nonce(payload):
+    # Nonce must match base64(SHA256(payload))
+    return base64.b64encode(hashlib.sha256(payload).digest()).decode('ascii')
+
+def _verdict(nonce, basic_integrity=True):
+    return json.dumps({
         "isValidSignature": True,
-        "basicIntegrity": True,
-        # Nonce must match SHA256(payload)
-        # We calculate it inside the test or make the mock dynamic?
-        # Easier to mock the return value to match what we expect
-        # But the nonce depends on the payload.
-        # Let's use side_effect or just ensure the nonce matches the one generated in the test.
+        "basicIntegrity": basic_integrity,
+        "nonce": nonce
     }).encode('utf-8')
+
+# Attestation API responses, encoded once for the whole module
+FLOW_NONCE = _nonce(struct.pack("<QdQ", 12345, 0.1234, 1))
+FLOW_GOOD = _verdict(FLOW_NONCE)
+FLOW_BAD_INTEGRITY = _verdict(FLOW_NONCE, basic_integrity=False)
+BATCH_GOOD = _verdict(_nonce(struct.pack("<QdQ", 1, 0.5, 1)))
+CACHE_NONCE = _nonce(b"payload")
+CACHE_GOOD = _verdict(CACHE_NONCE)
+
+class AttestationAPI:
+    """
+    Stand-in for the attestation endpoint: every request is answered with the
+    currently selected prebuilt verdict (`verdict`), with status 200.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.request = connection.return_value.request
+        self.verdict = b"{}"
+        response = connection.return_value.getresponse.return_value
+        response.status = 200
+        response.read.side_effect = lambda: self.verdict
+
+@contextmanager
+def _attestation_api():
+    with patch('http.client.HTTPSConnection') as mock_connection:
+        yield AttestationAPI(mock_connection)
+
+@pytest.fixture(autouse=True)
+def attestation_api():
+    # No test in this module may reach the real API
+    with _attestation_api() as api:
+        yield api
+
+def test_security_flow(attestation_api):
+    # 1. Setup
+    client_sec = SecurityManager()
+    gatekeeper = Gatekeeper()
+    
+    seed_id = 12345
+    scalar = 0.1234
+    round_id = 1
+    
+    # 2. Client Signs and Attests
+    signature = client_sec.sign_update(seed_id, scalar, round_id)
+    attestation = client_sec.get_attestation_token(seed_id, scalar, round_id)
+    public_key = client_sec.get_public_key_bytes()
+    
+    update = MockClientUpdate(seed_id, scalar, round_id, signature, attestation)
+    
+    # API returns the nonce of the valid update
+    attestation_api.verdict = FLOW_GOOD
+    
+    # 3. Server Verifies (Success Case)
+    assert gatekeeper.verify_update(update, public_key) == True
     
-    mock_response.__enter__.return_value = mock_response
-    mock_response.__exit__.return_value = None
-
-    # We need to compute the expected nonce to put in the mock
-    # But the test runs sequentially.
-    
-    with patch('urllib.request.urlopen', return_value=mock_response) as mock_urlopen:
-        # 1. Setup
-        client_sec = SecurityManager()
-        gatekeeper = Gatekeeper()
-        
-        seed_id = 12345
-        scalar = 0.1234
-        round_id = 1
-        
-        # 2. Client Signs and Attests
+    # 4. Tampering Test (Signature)
+    # Modify scalar but keep signature
+    tampered_update = MockClientUpdate(seed_id, scalar + 0.1, round_id, signature, attestation)
+    assert gatekeeper.verify_update(tampered_update, public_key) == False
+    
+    # 5. Tampering Test (Attestation)
+    # Modify scalar, re-sign, but keep old attestation (nonce mismatch)
+    new_scalar = scalar + 0.1
+    new_sig = client_sec.sign_update(seed_id, new_scalar, round_id)
+    # Attestation is bound to old scalar
+    tampered_attestation_update = MockClientUpdate(seed_id, new_scalar, round_id, new_sig, attestation)
+    
+    # The mock still returns the OLD nonce (valid for old payload), but we are verifying against NEW payload
+    # So verify_update should calculate NEW nonce, compare with OLD nonce from mock, and fail.
+    assert gatekeeper.verify_update(tampered_attestation_update, public_key) == False
+    
+    # 6. Invalid Attestation Verdict
+    # Update mock to return failure
+    attestation_api.verdict = FLOW_BAD_INTEGRITY
+    
+    bad_verdict_update = MockClientUpdate(seed_id, scalar, round_id, signature, attestation)
+    # A fresh Gatekeeper: the first one has the earlier positive verdict cached
+    assert Gatekeeper().verify_update(bad_verdict_update, public_key) == False
+
+def test_verify_batch(attestation_api):
+    client_sec = SecurityManager()
+    other_sec = SecurityManager()
+    gatekeeper = Gatekeeper()
+    round_id = 1
+    
+    updates = []
+    for seed_id, scalar in [(1, 0.5), (2, -0.25), (3, 1.5)]:
         signature = client_sec.sign_update(seed_id, scalar, round_id)
         attestation = client_sec.get_attestation_token(seed_id, scalar, round_id)
-        public_key = client_sec.get_public_key_bytes()
-        
-        update = MockClientUpdate(seed_id, scalar, round_id, signature, attestation)
-        
-        # Calculate expected nonce for the valid update
-        import hashlib
-        payload = f"{seed_id}:{scalar}:{round_id}".encode('utf-8')
-        expected_nonce = hashlib.sha256(payload).hexdigest()
-        
-        # Update mock to return correct nonce
-        mock_response.read.return_value = json.dumps({
-            "isValidSignature": True,
-            "basicIntegrity": True,
-            "nonce": expected_nonce
-        }).encode('utf-8')
-        
-        # 3. Server Verifies (Success Case)
-        assert gatekeeper.verify_update(update, public_key) == True
-        
-        # 4. Tampering Test (Signature)
-        # Modify scalar but keep signature
-        tampered_update = MockClientUpdate(seed_id, scalar + 0.1, round_id, signature, attestation)
-        assert gatekeeper.verify_update(tampered_update, public_key) == False
-        
-        # 5. Tampering Test (Attestation)
-        # Modify scalar, re-sign, but keep old attestation (nonce mismatch)
-        new_scalar = scalar + 0.1
-        new_sig = client_sec.sign_update(seed_id, new_scalar, round_id)
-        # Attestation is bound to old scalar
-        tampered_attestation_update = MockClientUpdate(seed_id, new_scalar, round_id, new_sig, attestation)
-        
-        # The mock still returns the OLD nonce (valid for old payload), but we are verifying against NEW payload
-        # So verify_update should calculate NEW nonce, compare with OLD nonce from mock, and fail.
-        assert gatekeeper.verify_update(tampered_attestation_update, public_key) == False
-        
-        # 6. Invalid Attestation Verdict
-        # Update mock to return failure
-        mock_response.read.return_value = json.dumps({
-            "isValidSignature": True,
-            "basicIntegrity": False, # Fail
-            "nonce": expected_nonce
-        }).encode('utf-8')
-        
-        bad_verdict_update = MockClientUpdate(seed_id, scalar, round_id, signature, attestation)
-        assert gatekeeper.verify_update(bad_verdict_update, public_key) == False
+        updates.append(MockClientUpdate(seed_id, scalar, round_id, signature, attestation))
+    # Tamper with the second update's scalar
+    updates[1].scalar += 0.1
+    
+    attestation_api.verdict = BATCH_GOOD
+    
+    public_key = client_sec.get_public_key_bytes()
+    keys = [public_key, public_key, other_sec.get_public_key_bytes()]
+    
+    # 0: valid, 1: bad signature, 2: wrong key
+    assert gatekeeper.verify_batch(updates, keys) == [True, False, False]
+    # Only the update with a valid signature reaches the attestation API
+    assert attestation_api.request.call_count == 1
+    # ...over a single kept-alive connection
+    assert attestation_api.connection.call_count == 1
+    
+    with pytest.raises(ValueError):
+        gatekeeper.verify_batch(updates, keys[:2])
+    
+    # Same round in columnar form
+    columns = {
+        "seed_ids": np.array([u.seed_id for u in updates], dtype=np.uint64),
+        "scalars": np.array([u.scalar for u in updates], dtype=np.float64),
+        "round_ids": np.array([u.round_id for u in updates], dtype=np.uint64),
+        "signatures": np.stack([np.frombuffer(u.signature, dtype=np.uint8) for u in updates]),
+        "public_keys": np.stack([np.frombuffer(k, dtype=np.uint8) for k in keys]),
+        "attestation_tokens": [u.attestation_token for u in updates],
+    }
+    assert gatekeeper.verify_batch_soa(columns) == [True, False, False]
+    
+    columns["attestation_tokens"] = columns["attestation_tokens"][:2]
+    with pytest.raises(ValueError):
+        gatekeeper.verify_batch_soa(columns)
+    
+    # Async fan-out gives the same verdicts, one result per update in order
+    assert asyncio.run(gatekeeper.verify_batch_async(updates, keys)) == [True, False, False]
+    gatekeeper.close()
+
+def test_malformed_payload(attestation_api):
+    client_sec = SecurityManager()
+    gatekeeper = Gatekeeper()
+    public_key = client_sec.get_public_key_bytes()
+    attestation_api.verdict = BATCH_GOOD
+    
+    signature = client_sec.sign_update(1, 0.5, 1)
+    attestation = client_sec.get_attestation_token(1, 0.5, 1)
+    good = MockClientUpdate(1, 0.5, 1, signature, attestation)
+    # A negative seed_id can't be packed as u64: rejected, not raised
+    bad = MockClientUpdate(-1, 0.5, 1, signature, attestation)
+    
+    assert gatekeeper.verify_update(bad, public_key) == False
+    # ...and one bad update doesn't abort the rest of the round
+    assert gatekeeper.verify_batch([good, bad], [public_key, public_key]) == [True, False]
+    gatekeeper.close()
+
+def test_public_key_cache():
+    from ruth.server import verifier
+    client_sec = SecurityManager()
+    public_key = client_sec.get_public_key_bytes()
+    # Serialized once per session, and still the key that verifies its signatures
+    assert client_sec.get_public_key_bytes() is public_key
+    assert len(public_key) == 32
+    
+    verifier._load_public_key.cache_clear()
+    first = verifier._load_public_key(public_key)
+    assert verifier._load_public_key(public_key) is first
+    assert verifier._load_public_key.cache_info().hits == 1
+    
+    # Malformed keys are rejected, not cached
+    with pytest.raises(ValueError):
+        verifier._load_public_key(b"short")
+    assert verifier._load_public_key.cache_info().currsize == 1
+
+def test_attestation_cache(monkeypatch, attestation_api):
+    from ruth.server import verifier
+    
+    nonce = CACHE_NONCE
+    attestation_api.verdict = CACHE_GOOD
+    
+    now = [1000.0]
+    monkeypatch.setattr(verifier.time, "monotonic", lambda: now[0])
+    
+    request = attestation_api.request
+    gatekeeper = Gatekeeper()
+    
+    assert gatekeeper._verify_attestation(b"token", nonce)
+    assert gatekeeper._verify_attestation(b"token", nonce)
+    assert request.call_count == 1
+    
+    # Same token, different nonce: not a hit (and fails against the API)
+    assert not gatekeeper._verify_attestation(b"token", "other_nonce")
+    assert request.call_count == 2
+    
+    # Failures are never cached
+    assert not gatekeeper._verify_attestation(b"token", "other_nonce")
+    assert request.call_count == 3
+    
+    # Expired entries go back to the API
+    now[0] += verifier.ATTESTATION_CACHE_TTL + 1
+    assert gatekeeper._verify_attestation(b"token", nonce)
+    assert request.call_count == 4
+
+def test_nonce_matches():
+    from ruth.server.verifier import _nonce_matches
+    assert _nonce_matches("abc=", "abc=")
+    assert not _nonce_matches("abd=", "abc=")
+    # Malformed API responses are mismatches, not errors
+    assert not _nonce_matches(None, "abc=")
+    assert not _nonce_matches(123, "abc=")
+    assert not _nonce_matches("ab\u00e9=", "abc=")
+
+def test_attestation_nonces():
+    from ruth.server.verifier import attestation_nonces
+    payloads = [b"payload", struct.pack("<QdQ", 1, 0.5, 1), b""]
+    assert attestation_nonces(payloads) == [_nonce(payload) for payload in payloads]
+    assert attestation_nonces([]) == []
+
+def test_payload_bytes():
+    from ruth.client import security
+    from ruth.server import verifier
+    payload = security._payload_bytes(42, 0.5, 7)
+    # Signer and verifier must agree byte for byte; 24 bytes fit a single SHA-256 block
+    assert payload == verifier._payload_bytes(42, 0.5, 7)
+    assert len(payload) == 24
+    assert payload == (42).to_bytes(8, "little") + bytes.fromhex("000000000000e03f") + (7).to_bytes(8, "little")
+
+def test_attestation_body(attestation_api):
+    from ruth.server.verifier import _attestation_body
+    for token in ["mock_integrity_token_from_device", "eyJhbGciOi.eyJub25jZSI6.c2lnbmF0dXJl+/=", 'quote"back\\slash\n', "caf\u00e9"]:
+        body = _attestation_body(token.encode('utf-8'))
+        assert json.loads(body) == {"signedAttestation": token}
+    
+    # Template and json.dumps produce the same bytes for plain tokens
+    assert _attestation_body(b"abc") == json.dumps({"signedAttestation": "abc"}).encode('utf-8')
+    
+    # Tokens that aren't valid UTF-8 fail verification instead of raising
+    with pytest.raises(UnicodeDecodeError):
+        _attestation_body(b"\xff\xfe")
+    assert not Gatekeeper()._verify_attestation(b"\xff\xfe", CACHE_NONCE)
+    assert attestation_api.request.call_count == 0
 
 if __name__ == "__main__":
-    test_security_flow()
+    with _attestation_api() as api:
+        test_security_flow(api)
+    with _attestation_api() as api:
+        test_verify_batch(api)
+    with _attestation_api() as api:
+        test_malformed_payload(api)
+    test_public_key_cache()
+    with _attestation_api() as api, pytest.MonkeyPatch.context() as monkeypatch:
+        test_attestation_cache(monkeypatch, api)
+    test_nonce_matches()
+    test_attestation_nonces()
+    test_payload_bytes()
+    with _attestation_api() as api:
+        test_attestation_body(api)
     print("All Security tests passed!")